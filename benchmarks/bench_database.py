@@ -0,0 +1,119 @@
+"""
+بنچمارک عملیات پرتکرار DatabaseManager.
+
+before:   اتصال جدید برای هر فراخوانی و commit برای هر نوشتن (رفتار اولیه)
+pooled:   اتصال ثابت هر thread با WAL، هنوز commit برای هر نوشتن
+buffered: اتصال ثابت به همراه نوشتن دسته‌ای (رفتار فعلی)
+
+    python benchmarks/bench_database.py --ops 5000 --threads 4
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def direct_writes(base):
+    # هر نوشتن بلافاصله با commit جداگانه انجام می‌شود
+    class DirectWritesDatabaseManager(base):
+        def add_user(self, user_id, username, first_name, last_name):
+            with self.get_connection() as conn:
+                conn.execute('''
+                    INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, username, first_name, last_name))
+                conn.commit()
+
+        def increment_download_count(self, user_id):
+            with self.get_connection() as conn:
+                conn.execute('''
+                    UPDATE users SET
+                    downloads_count = downloads_count + 1,
+                    last_download = CURRENT_TIMESTAMP
+                    WHERE user_id = ?
+                ''', (user_id,))
+                conn.commit()
+
+    return DirectWritesDatabaseManager
+
+
+def per_call_connections(base):
+    # هر فراخوانی یک اتصال جدید در حالت rollback journal باز می‌کند
+    class PerCallDatabaseManager(base):
+        @contextmanager
+        def get_connection(self):
+            conn = sqlite3.connect(self.db_name)
+            conn.row_factory = sqlite3.Row
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+    return PerCallDatabaseManager
+
+
+def measure(func, ops):
+    started = time.perf_counter()
+    for i in range(ops):
+        func(i)
+    return ops / (time.perf_counter() - started)
+
+
+def measure_threads(db, ops, threads):
+    errors = []
+
+    def worker(offset):
+        for i in range(ops):
+            try:
+                db.increment_download_count(offset + i % 100)
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    pool = [threading.Thread(target=worker, args=(t * 100,)) for t in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return ops * threads / (time.perf_counter() - started), len(errors)
+
+
+def run(name, db, ops, threads):
+    for i in range(threads * 100):
+        db.add_user(i, f"user{i}", "Bench", None)
+    results = {
+        "add_user": measure(lambda i: db.add_user(100000 + i, f"u{i}", "Bench", None), ops),
+        "increment_download_count": measure(lambda i: db.increment_download_count(i % 100), ops),
+        "get_user_stats": measure(lambda i: db.get_user_stats(i % 100), ops),
+    }
+    threaded, errors = measure_threads(db, ops // threads, threads)
+    db.flush()
+    for op, rate in results.items():
+        print(f"{name:<10}{op:<28}{rate:>12.0f}")
+    print(f"{name:<10}{f'increment x{threads} threads':<28}{threaded:>12.0f}  locked={errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ops", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="bench_database_"))
+    from bot import DatabaseManager
+
+    print(f"{'mode':<10}{'operation':<28}{'ops/sec':>12}")
+    run("before", per_call_connections(direct_writes(DatabaseManager))("before.db"), args.ops, args.threads)
+    run("pooled", direct_writes(DatabaseManager)("pooled.db"), args.ops, args.threads)
+    run("buffered", DatabaseManager("buffered.db"), args.ops, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+بنچمارک سرتاسری bot.py: از رسیدن update تا تحویل رسانه به Bot API.
+
+upstream، CDN و Bot API با سرورهای جعلی benchmarks/fakes.py (در یک پروسه جدا) جایگزین می‌شوند،
+FASTCREATE_API و آدرس API تلگرام به آن‌ها اشاره می‌کنند و update های ساختگی با نرخ دلخواه
+به ربات داده می‌شوند. تأخیر هر update از لحظه ارسال تا اولین پاسخ نهایی در همان چت
+(رسانه یا پیام خطا) اندازه‌گیری می‌شود. هیچ درخواستی به اینترنت ارسال نمی‌شود.
+
+با --workers N، bot.py به صورت پروسه ناظر و N کارگر اجرا می‌شود و update ها از مسیر getUpdates
+Bot API جعلی دریافت می‌شوند؛ حافظه در این حالت مجموع پروسه‌هاست.
+
+    python benchmarks/bench_e2e.py --updates 500 --rate 100 --items 3 --upstream-error-rate 0.05
+    python benchmarks/bench_e2e.py --updates 2000 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import add_fake_arguments, describe, fake_options, point_bot_at, start_fake_backends  # noqa: E402
+
+MEDIA_METHODS = ("sendVideo", "sendPhoto", "sendMediaGroup")
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def process_rss_mb(pid, field):
+    """VmRSS (فعلی) یا VmHWM (بیشینه) یک پروسه"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return 0.0
+
+
+def make_updates(count, links):
+    updates = []
+    now = int(time.time())
+    for i in range(count):
+        user_id = 1000 + i
+        updates.append({
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+                "text": f"https://www.instagram.com/reel/Bench{i % links}/",
+            },
+        })
+    return updates
+
+
+async def dispatch(deliver, updates, rate):
+    """update ها را با نرخ rate در ثانیه (صفر: همه با هم) به deliver می‌دهد و زمان ارسال هر چت را برمی‌گرداند"""
+    dispatched = {}
+    if rate <= 0:
+        now = time.time()
+        for update in updates:
+            dispatched[update["message"]["chat"]["id"]] = now
+        await deliver(updates)
+        return dispatched
+
+    tasks = []
+    started = time.perf_counter()
+    for i, update in enumerate(updates):
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        dispatched[update["message"]["chat"]["id"]] = time.time()
+        tasks.append(asyncio.create_task(deliver([update])))
+    await asyncio.gather(*tasks)
+    return dispatched
+
+
+async def wait_for_replies(session, base, count, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        async with session.get(f"{base}/_stats") as resp:
+            stats = await resp.json()
+        if len(stats["done"]) >= count or time.monotonic() >= deadline:
+            return stats
+        await asyncio.sleep(0.05)
+
+
+async def start_bot():
+    import bot
+
+    await bot.download_scheduler.start()
+    return bot, asyncio.create_task(bot.flush_writes_periodically())
+
+
+async def stop_bot(bot, flusher):
+    await bot.download_scheduler.stop()
+    flusher.cancel()
+    await bot.upstream.close()
+    await bot.bot.close_session()
+    bot.db.flush()
+    bot.db.close()
+
+
+async def run(args, base):
+    import aiohttp
+    from telebot import types
+
+    bot, flusher = await start_bot()
+    baseline_rss = current_rss_mb()
+    updates = make_updates(args.updates, args.links or args.updates)
+
+    async def deliver(batch):
+        await bot.bot.process_new_updates([types.Update.de_json(update) for update in batch])
+
+    async with aiohttp.ClientSession() as session:
+        await session.delete(f"{base}/_stats")
+        dispatched = await dispatch(deliver, updates, args.rate)
+        stats = await wait_for_replies(session, base, len(updates), args.timeout)
+
+    await stop_bot(bot, flusher)
+    return summarize(updates, dispatched, stats, baseline_rss, peak_rss_mb())
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_processes(args, base):
+    """bot.py در حالت چندپروسه‌ای؛ update ها از getUpdates سرور جعلی به پروسه ناظر می‌رسند"""
+    import aiohttp
+
+    port = free_port()
+    env = dict(os.environ, BOT_WORKERS=str(args.workers), PORT=str(port), BOT_WORKER_PORT_BASE=str(free_port()))
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "bot.py")], env=env, stdout=subprocess.DEVNULL)
+    updates = make_updates(args.updates, args.links or args.updates)
+    try:
+        async with aiohttp.ClientSession() as session:
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    async with session.get(f"http://127.0.0.1:{port}/health") as resp:
+                        if resp.status == 200:
+                            # با یک کارگر، bot.py بدون پروسه ناظر اجرا می‌شود
+                            workers = (await resp.json())["workers"] if args.workers > 1 else []
+                            break
+                except aiohttp.ClientError:
+                    pass
+                if time.monotonic() >= deadline or process.poll() is not None:
+                    raise RuntimeError("bot.py did not start")
+                await asyncio.sleep(0.2)
+
+            pids = [process.pid] + [worker["pid"] for worker in workers]
+            baseline_rss = sum(process_rss_mb(pid, "VmRSS") for pid in pids)
+
+            async def deliver(batch):
+                async with session.post(f"{base}/_updates", json=[
+                    {key: value for key, value in update.items() if key != "update_id"} for update in batch
+                ]) as resp:
+                    await resp.read()
+
+            await session.delete(f"{base}/_stats")
+            dispatched = await dispatch(deliver, updates, args.rate)
+            stats = await wait_for_replies(session, base, len(updates), args.timeout)
+            peak_rss = sum(process_rss_mb(pid, "VmHWM") for pid in pids)
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return summarize(updates, dispatched, stats, baseline_rss, peak_rss)
+
+
+def summarize(updates, dispatched, stats, baseline_rss, peak_rss):
+    done = {int(chat_id): value for chat_id, value in stats["done"].items()}
+    latencies = sorted(done[chat_id][0] - sent for chat_id, sent in dispatched.items() if chat_id in done)
+    delivered = sum(1 for _, method in done.values() if method in MEDIA_METHODS)
+    elapsed = max(finished for finished, _ in done.values()) - min(dispatched.values()) if done else 0
+    return {
+        "updates": len(updates),
+        "completed": len(done),
+        "delivered": delivered,
+        "failed": len(done) - delivered,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(done) / elapsed, 2) if elapsed else 0,
+        "latency_ms": {
+            name: round(percentile(latencies, p) * 1000, 1)
+            for name, p in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+        },
+        "rss_mb": {
+            "baseline": round(baseline_rss, 1),
+            "peak": round(peak_rss, 1),
+        },
+        "telegram_calls": stats["calls"],
+        "fakes": stats["counters"],
+    }
+
+
+def print_report(args, result):
+    print(f"updates={args.updates} links={args.links or args.updates} rate={args.rate or 'max'}/s "
+          f"workers={args.workers or 'in-process'}")
+    print(describe(fake_options(args)))
+    print()
+    print(f"completed   {result['completed']}/{result['updates']} "
+          f"(delivered {result['delivered']}, failed {result['failed']}) in {result['seconds']:.2f}s")
+    print(f"throughput  {result['throughput']:.1f} updates/s")
+    latency = result["latency_ms"]
+    print(f"latency     p50 {latency['p50']:.0f} ms  p95 {latency['p95']:.0f} ms  "
+          f"p99 {latency['p99']:.0f} ms  max {latency['max']:.0f} ms")
+    print(f"memory      baseline {result['rss_mb']['baseline']:.1f} MB  peak {result['rss_mb']['peak']:.1f} MB")
+    print(f"telegram    {', '.join(f'{m}={n}' for m, n in sorted(result['telegram_calls'].items()))}")
+    print(f"fakes       {', '.join(f'{k}={v}' for k, v in result['fakes'].items())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--links", type=int, default=0, help="distinct links (default: one per update)")
+    parser.add_argument("--rate", type=float, default=0, help="updates per second (0: all at once)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="run bot.py as a supervisor with N worker processes (0: in this process)")
+    add_fake_arguments(parser)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    process, base = start_fake_backends(**fake_options(args))
+    try:
+        point_bot_at(base)
+        # دیتابیس، پوشه دانلود و کش دیسکی در یک پوشه موقت ساخته می‌شوند
+        sys.path.insert(0, ROOT)
+        os.chdir(tempfile.mkdtemp(prefix="bench_e2e_"))
+        result = asyncio.run(run_processes(args, base) if args.workers else run(args, base))
+    finally:
+        process.terminate()
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(args, result)
+
+
+if __name__ == "__main__":
+    main()
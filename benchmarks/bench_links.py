@@ -0,0 +1,90 @@
+"""
+بنچمارک تشخیص لینک اینستاگرام روی متن پیام‌های واقعی.
+
+before: is_instagram_url اولیه (سه الگوی re.match که هر بار دوباره ساخته می‌شوند)
+parser: parse_instagram_url در links.py (یک الگوی از پیش کامپایل‌شده و شکل استاندارد لینک)
+
+    python benchmarks/bench_links.py --rounds 2000
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# نمونه متن پیام‌هایی که کاربران برای ربات می‌فرستند
+CORPUS = [
+    "https://www.instagram.com/p/C3xYz12AbCd/",
+    "https://www.instagram.com/reel/C4kLmNoPqRs/?igsh=MWd2bXh6eWZ1dGx5cg==",
+    "https://instagram.com/reels/C5aBcDeFgHi/",
+    "https://www.instagram.com/tv/B9xYzAbCdEf/?utm_source=ig_web_copy_link",
+    "https://m.instagram.com/p/C3xYz12AbCd/",
+    "http://instagr.am/p/C3xYz12AbCd/",
+    "instagram.com/p/C3xYz12AbCd",
+    "https://www.instagram.com/natgeo/p/C3xYz12AbCd/",
+    "https://www.instagram.com/stories/natgeo/3312345678901234567/",
+    "https://www.instagram.com/stories/natgeo/3312345678901234567?utm_source=ig_story_item_share&igsh=abc",
+    "لطفا این رو دانلود کن https://www.instagram.com/reel/C4kLmNoPqRs/?igsh=abc ممنون",
+    "Check this out!\nhttps://www.instagram.com/p/C3xYz12AbCd/?img_index=2",
+    "  https://www.instagram.com/reel/C4kLmNoPqRs/  ",
+    "https://www.instagram.com/natgeo/",
+    "https://www.instagram.com/explore/tags/travel/",
+    "https://www.instagram.com/reels/audio/123456789012345/",
+    "https://youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://notinstagram.com/p/C3xYz12AbCd/",
+    "سلام، ربات کار نمی‌کنه؟",
+    "/start",
+    "hi",
+    "https://t.me/some_channel/123",
+]
+
+
+def is_instagram_url_before(url):
+    if not url:
+        return False
+    patterns = [
+        r'https?://(www\.)?instagram\.com/(p|reel|stories)/[^/]+/?',
+        r'https?://(www\.)?instagram\.com/(p|reel)/[^/]+/?',
+        r'https?://(www\.)?instagram\.com/stories/[^/]+/\d+/?'
+    ]
+    for pattern in patterns:
+        if re.match(pattern, url.strip()):
+            return True
+    return False
+
+
+def measure(func, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for text in CORPUS:
+            func(text)
+    return (time.perf_counter() - started) / (rounds * len(CORPUS)) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--show", action="store_true", help="نتیجه هر نمونه را هم چاپ می‌کند")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from links import parse_instagram_url
+
+    if args.show:
+        for text in CORPUS:
+            link = parse_instagram_url(text)
+            before = is_instagram_url_before(text)
+            print(f"{str(before):<7}{str(link and (link.kind, link.shortcode)):<38}{text!r}")
+        print()
+
+    before_accepted = sum(1 for text in CORPUS if is_instagram_url_before(text))
+    parser_accepted = sum(1 for text in CORPUS if parse_instagram_url(text))
+    print(f"{'mode':<10}{'ns/message':>12}{'accepted':>10}")
+    print(f"{'before':<10}{measure(is_instagram_url_before, args.rounds):>12.0f}{before_accepted:>10}")
+    print(f"{'parser':<10}{measure(parse_instagram_url, args.rounds):>12.0f}{parser_accepted:>10}")
+
+
+if __name__ == "__main__":
+    main()
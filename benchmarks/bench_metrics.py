@@ -0,0 +1,61 @@
+"""
+هزینه ثبت متریک در مسیر پرتکرار (metrics.py).
+
+    python benchmarks/bench_metrics.py --ops 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(func, ops):
+    started = time.perf_counter()
+    for _ in range(ops):
+        func()
+    return (time.perf_counter() - started) / ops * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ops", type=int, default=1000000)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from metrics import Registry, timed_methods
+
+    registry = Registry()
+    counter = registry.counter("bench_total", "Counter.", ("type",))
+    histogram = registry.histogram("bench_seconds", "Histogram.", ("method",))
+
+    class Plain:
+        def method(self):
+            pass
+
+    @timed_methods(histogram)
+    class Timed:
+        def method(self):
+            pass
+
+    plain = Plain()
+    timed = Timed()
+    labels = ("message",)
+    empty = measure(lambda: None, args.ops)
+    results = {
+        "counter.inc": measure(lambda: counter.inc(labels), args.ops),
+        "histogram.observe": measure(lambda: histogram.observe(0.0042, labels), args.ops),
+        "timed method overhead": measure(timed.method, args.ops) - measure(plain.method, args.ops) + empty,
+    }
+
+    print(f"{'operation':<26}{'ns/op':>10}")
+    for name, cost in results.items():
+        print(f"{name:<26}{cost - empty:>10.0f}")
+    started = time.perf_counter()
+    registry.render()
+    print(f"{'render':<26}{(time.perf_counter() - started) * 1e9:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+مقایسه توان عملیاتی حالت threaded (main.py) با حالت async (bot.py).
+
+سرورهای جعلی benchmarks/fakes.py نقش api.fast-creat.ir و Bot API تلگرام را با تأخیر مصنوعی بازی می‌کنند،
+سپس N پیام حاوی لینک اینستاگرام به هر دو ربات داده می‌شود و زمان تحویل همه آن‌ها
+اندازه‌گیری می‌شود. هیچ درخواستی به اینترنت ارسال نمی‌شود.
+
+    python benchmarks/bench_runtime.py --updates 200 --upstream-latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import add_fake_arguments, describe, fake_options, point_bot_at, start_fake_backends  # noqa: E402
+
+MEDIA_METHODS = ("sendVideo", "sendPhoto", "sendMediaGroup")
+
+
+def reset(base):
+    urllib.request.urlopen(urllib.request.Request(f"{base}/_stats", method="DELETE")).read()
+
+
+def wait_for(base, count, timeout):
+    """تا رسیدن count ارسال رسانه به Bot API جعلی صبر می‌کند"""
+    deadline = time.monotonic() + timeout
+    while True:
+        with urllib.request.urlopen(f"{base}/_stats") as resp:
+            calls = json.load(resp)["calls"]
+        if sum(calls.get(method, 0) for method in MEDIA_METHODS) >= count:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.005)
+
+
+def make_updates(count):
+    from telebot import types
+
+    updates = []
+    for i in range(count):
+        user_id = 1000 + i
+        updates.append(types.Update.de_json({
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "bench"},
+                "text": f"https://www.instagram.com/reel/Bench{i}/",
+            },
+        }))
+    return updates
+
+
+def run_threaded(base, updates, timeout):
+    import main
+
+    # main.py آدرس upstream را از محیط نمی‌خواند
+    main.FASTCREATE_API = os.environ["FASTCREATE_API"]
+    reset(base)
+    started = time.perf_counter()
+    main.bot.process_new_updates(updates)
+    finished = wait_for(base, len(updates), timeout)
+    elapsed = time.perf_counter() - started
+    main.bot.worker_pool.close()
+    return elapsed, finished
+
+
+def run_async(base, updates, timeout):
+    import bot
+
+    async def runner():
+        await bot.download_scheduler.start()
+        reset(base)
+        started = time.perf_counter()
+        await bot.bot.process_new_updates(updates)
+        finished = await asyncio.to_thread(wait_for, base, len(updates), timeout)
+        elapsed = time.perf_counter() - started
+        await bot.download_scheduler.stop()
+        await bot.bot.close_session()
+        await bot.upstream.close()
+        return elapsed, finished
+
+    return asyncio.run(runner())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--updates", type=int, default=200)
+    add_fake_arguments(parser)
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    process, base = start_fake_backends(**fake_options(args))
+    try:
+        point_bot_at(base)
+        # دیتابیس و پوشه دانلود هر دو ربات در یک پوشه موقت ساخته می‌شوند
+        sys.path.insert(0, ROOT)
+        os.chdir(tempfile.mkdtemp(prefix="bench_runtime_"))
+
+        print(f"updates={args.updates}")
+        print(describe(fake_options(args)))
+        print(f"{'mode':<10}{'seconds':>10}{'updates/s':>12}  complete")
+        for name, runner in (("threaded", run_threaded), ("async", run_async)):
+            elapsed, finished = runner(base, make_updates(args.updates), args.timeout)
+            print(f"{name:<10}{elapsed:>10.2f}{args.updates / elapsed:>12.1f}  {finished}")
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+اندازه‌گیری حافظه (RSS) هنگام آپلود یک فایل بزرگ به تلگرام.
+
+buffered:  فایل کامل از CDN خوانده و سپس آپلود می‌شود
+streaming: StreamingUploader در uploader.py (هر تکه بلافاصله آپلود می‌شود)
+
+CDN و Bot API جعلی (benchmarks/fakes.py) در یک پروسه جدا اجرا می‌شوند تا فقط حافظه پروسه آپلودکننده اندازه‌گیری شود.
+هر حالت هم در پروسه جدید اجرا می‌شود تا بیشینه RSS آن مستقل باشد.
+
+    python benchmarks/bench_upload.py --size-mb 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import start_fake_backends  # noqa: E402
+
+MEDIA_PATH = "/cdn/bench/0.mp4"
+
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def child(mode, base):
+    import aiohttp
+    import telebot.asyncio_helper
+    from telebot.async_telebot import AsyncTeleBot
+    from uploader import StreamingUploader
+
+    telebot.asyncio_helper.API_URL = base + "/bot{0}/{1}"
+    bot = AsyncTeleBot("1:bench")
+    session = aiohttp.ClientSession()
+
+    async def get_session():
+        return session
+
+    # یک درخواست کوچک تا اتصال‌ها و import ها قبل از اندازه‌گیری آماده باشند
+    await bot.send_message(1, "warmup")
+    async with session.delete(base + "/_stats") as response:
+        await response.read()
+    baseline = current_rss_mb()
+    sampled = baseline
+    done = asyncio.Event()
+
+    async def sample():
+        nonlocal sampled
+        while not done.is_set():
+            sampled = max(sampled, current_rss_mb())
+            await asyncio.sleep(0.02)
+
+    sampler = asyncio.create_task(sample())
+    started = time.perf_counter()
+    if mode == "streaming":
+        sent = await StreamingUploader(bot, get_session).send(1, "video", base + MEDIA_PATH, "bench")
+    else:
+        async with session.get(base + MEDIA_PATH) as response:
+            data = await response.read()
+        sent = await bot.send_video(1, video=("video.mp4", data), caption="bench", timeout=600)
+    elapsed = time.perf_counter() - started
+    done.set()
+    await sampler
+    await session.close()
+    await bot.close_session()
+    with urllib.request.urlopen(base + "/_stats") as resp:
+        uploaded = json.load(resp)["counters"]["uploaded_bytes"]
+    print(f"{mode:<11}{elapsed:>9.2f}{baseline:>13.1f}{sampled:>13.1f}{sampled - baseline:>10.1f}"
+          f"{peak_rss_mb():>13.1f}  {sent.video.file_id} ({uploaded} bytes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=50)
+    parser.add_argument("--child", choices=("buffered", "streaming"))
+    parser.add_argument("--base")
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, ROOT)
+        asyncio.run(child(args.child, args.base))
+        return
+
+    servers, base = start_fake_backends(media_kb=args.size_mb * 1024, telegram_latency=0)
+
+    print(f"size={args.size_mb} MB")
+    print(f"{'mode':<11}{'seconds':>9}{'rss before':>13}{'rss during':>13}{'growth':>10}{'peak rss':>13}")
+    try:
+        for mode in ("buffered", "streaming"):
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, "--base", base], check=True)
+    finally:
+        servers.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+سرورهای جعلی upstream (api.fast-creat.ir)، CDN اینستاگرام و Bot API تلگرام برای بنچمارک‌ها.
+
+سرورها در یک پروسه جدا اجرا می‌شوند تا حافظه و CPU آن‌ها در اندازه‌گیری ربات حساب نشود.
+تأخیر، نرخ خطا، تعداد آیتم هر پست و حجم فایل‌ها قابل تنظیم است و نتیجه‌ها با یک seed ثابت
+تکرارپذیر هستند. هر فراخوانی Bot API با زمان آن ثبت و از مسیر /_stats قابل خواندن است.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import time
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+CHUNK = 64 * 1024
+
+# پیام‌هایی که پایان پردازش یک لینک نیستند (پاسخ اولیه و جایگاه در صف)
+PENDING_PREFIXES = ("⏳ Downloading", "🕒 You are")
+
+DEFAULTS = {
+    "upstream_latency": 0.5,
+    "upstream_jitter": 0.0,
+    "upstream_error_rate": 0.0,
+    "upstream_tail_rate": 0.0,
+    "upstream_tail_latency": 5.0,
+    "telegram_latency": 0.05,
+    "telegram_jitter": 0.0,
+    "telegram_error_rate": 0.0,
+    "url_fetch_error_rate": 0.0,
+    "items": 1,
+    "media_kb": 512,
+    "seed": 1,
+}
+
+
+def _delay(rng, latency, jitter):
+    return max(0.0, latency + rng.uniform(-jitter, jitter)) if jitter else latency
+
+
+async def _read_params(request):
+    """پارامترهای درخواست Bot API؛ telebot بعضی متدها را با GET و بدنه form ارسال می‌کند"""
+    params = dict(request.query)
+    uploaded = 0
+    if request.content_type.startswith("multipart/"):
+        reader = await request.multipart()
+        async for part in reader:
+            if part.filename:
+                while chunk := await part.read_chunk(CHUNK):
+                    uploaded += len(chunk)
+            else:
+                params[part.name] = await part.text()
+    elif request.can_read_body:
+        params.update(parse_qsl(await request.text()))
+    return params, uploaded
+
+
+class FakeBackends:
+    def __init__(self, **options):
+        unknown = set(options) - set(DEFAULTS)
+        if unknown:
+            raise TypeError(f"unknown options: {', '.join(sorted(unknown))}")
+        self.options = dict(DEFAULTS, **options)
+        self.rng = random.Random(self.options["seed"])
+        self.media = b"\0" * (self.options["media_kb"] * 1024)
+        self.message_id = 0
+        # آپدیت‌هایی که بنچمارک برای getUpdates قرار داده است
+        self.updates = []
+        self.update_id = 0
+        self._new_updates = asyncio.Event()
+        self.calls = {}
+        self.done = {}
+        self.counters = {
+            "upstream_requests": 0,
+            "upstream_errors": 0,
+            "upstream_tail": 0,
+            "telegram_errors": 0,
+            "url_fetch_errors": 0,
+            "cdn_requests": 0,
+            "uploaded_bytes": 0,
+        }
+
+    # --- upstream ---
+
+    async def upstream(self, request):
+        options = self.options
+        self.counters["upstream_requests"] += 1
+        delay = _delay(self.rng, options["upstream_latency"], options["upstream_jitter"])
+        # بخش کوچکی از درخواست‌ها خیلی کند هستند (دنباله توزیع تأخیر)
+        if self.rng.random() < options["upstream_tail_rate"]:
+            self.counters["upstream_tail"] += 1
+            delay = options["upstream_tail_latency"]
+        await asyncio.sleep(delay)
+        if self.rng.random() < options["upstream_error_rate"]:
+            self.counters["upstream_errors"] += 1
+            return web.json_response({"ok": False, "error": "fake upstream error"}, status=500)
+
+        shortcode = request.query.get("url", "").rstrip("/").rsplit("/", 1)[-1] or "post"
+        base = f"http://{request.host}/cdn/{shortcode}"
+        items = []
+        for index in range(options["items"]):
+            items.append({
+                "is_video": index % 2 == 0,
+                "video_url": f"{base}/{index}.mp4",
+                "display_url": f"{base}/{index}.jpg",
+                "caption": f"benchmark {shortcode}",
+            })
+        return web.json_response({"ok": True, "result": {"result": items}})
+
+    async def cdn(self, request):
+        self.counters["cdn_requests"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+        response.content_length = len(self.media)
+        await response.prepare(request)
+        for start in range(0, len(self.media), CHUNK):
+            await response.write(self.media[start:start + CHUNK])
+        return response
+
+    # --- Bot API ---
+
+    def _message(self, chat_id, method, params):
+        self.message_id += 1
+        message = {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+        }
+        file_id = f"fake-{self.message_id}"
+        if method == "sendVideo":
+            message["video"] = {"file_id": file_id, "file_unique_id": file_id,
+                                "width": 1, "height": 1, "duration": 1}
+        elif method == "sendPhoto":
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}]
+        elif "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    def _record(self, chat_id, method, params):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method in ("sendVideo", "sendPhoto", "sendMediaGroup"):
+            terminal = True
+        elif method == "sendMessage":
+            terminal = not params.get("text", "").startswith(PENDING_PREFIXES)
+        else:
+            terminal = False
+        # زمان و نوع اولین پاسخ نهایی هر چت (رسانه یا پیام خطا)
+        if terminal and chat_id not in self.done:
+            self.done[chat_id] = (time.time(), method)
+
+    def _error(self, code, description):
+        return web.json_response({"ok": False, "error_code": code, "description": description}, status=code)
+
+    async def telegram(self, request):
+        options = self.options
+        method = request.match_info["method"]
+        params, uploaded = await _read_params(request)
+        self.counters["uploaded_bytes"] += uploaded
+        await asyncio.sleep(_delay(self.rng, options["telegram_latency"], options["telegram_jitter"]))
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        chat_id = int(params.get("chat_id") or 0)
+        if method in ("sendVideo", "sendPhoto", "sendMediaGroup"):
+            if self.rng.random() < options["telegram_error_rate"]:
+                self.counters["telegram_errors"] += 1
+                return self._error(500, "Internal Server Error: fake")
+            if method == "sendMediaGroup":
+                sources = [item["media"] for item in json.loads(params.get("media", "[]"))]
+            else:
+                sources = [params.get("video") or params.get("photo") or ""]
+            # فقط ارسال با لینک CDN می‌تواند با خطای دریافت لینک مواجه شود
+            if any(source.startswith("http") for source in sources) and \
+                    self.rng.random() < options["url_fetch_error_rate"]:
+                self.counters["url_fetch_errors"] += 1
+                return self._error(400, "Bad Request: failed to get HTTP URL content")
+
+        self._record(chat_id, method, params)
+        if method == "sendMediaGroup":
+            result = []
+            for item in json.loads(params["media"]):
+                kind = "sendVideo" if item["type"] == "video" else "sendPhoto"
+                result.append(self._message(chat_id, kind, params))
+        elif method in ("sendMessage", "sendVideo", "sendPhoto"):
+            result = self._message(chat_id, method, params)
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "getChatMember":
+            result = {"status": "member", "user": {"id": int(params.get("user_id", 0)), "is_bot": False,
+                                                   "first_name": "bench"}}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        # آپدیت‌های تأییدشده (کمتر از offset) حذف می‌شوند، مثل Bot API
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(params.get("limit") or 100)]
+
+    async def push_updates(self, request):
+        """آپدیت‌ها (فقط محتوا، بدون update_id) را به صف getUpdates اضافه و زمان اضافه شدن را برمی‌گرداند"""
+        for update in await request.json():
+            self.update_id += 1
+            self.updates.append(dict(update, update_id=self.update_id))
+        self._new_updates.set()
+        return web.json_response({"ok": True, "time": time.time()})
+
+    async def stats(self, request):
+        if request.method == "DELETE":
+            self.calls.clear()
+            self.done.clear()
+            for name in self.counters:
+                self.counters[name] = 0
+            return web.json_response({"ok": True})
+        return web.json_response({
+            "calls": self.calls,
+            "counters": self.counters,
+            "done": self.done,
+        })
+
+    def app(self):
+        app = web.Application(client_max_size=0)
+        app.router.add_get("/instagram", self.upstream)
+        app.router.add_get("/cdn/{shortcode}/{name}", self.cdn)
+        app.router.add_route("*", "/bot{token}/{method}", self.telegram)
+        app.router.add_route("*", "/_stats", self.stats)
+        app.router.add_post("/_updates", self.push_updates)
+        return app
+
+
+def add_fake_arguments(parser):
+    """پارامترهای سرورهای جعلی در خط فرمان بنچمارک‌ها"""
+    parser.add_argument("--upstream-latency", type=float, default=DEFAULTS["upstream_latency"])
+    parser.add_argument("--upstream-jitter", type=float, default=DEFAULTS["upstream_jitter"])
+    parser.add_argument("--upstream-error-rate", type=float, default=DEFAULTS["upstream_error_rate"])
+    parser.add_argument("--upstream-tail-rate", type=float, default=DEFAULTS["upstream_tail_rate"],
+                        help="share of upstream requests that take --upstream-tail-latency")
+    parser.add_argument("--upstream-tail-latency", type=float, default=DEFAULTS["upstream_tail_latency"])
+    parser.add_argument("--telegram-latency", type=float, default=DEFAULTS["telegram_latency"])
+    parser.add_argument("--telegram-jitter", type=float, default=DEFAULTS["telegram_jitter"])
+    parser.add_argument("--telegram-error-rate", type=float, default=DEFAULTS["telegram_error_rate"])
+    parser.add_argument("--url-fetch-error-rate", type=float, default=DEFAULTS["url_fetch_error_rate"],
+                        help="share of sends by URL that Telegram cannot fetch (forces streaming upload)")
+    parser.add_argument("--items", type=int, default=DEFAULTS["items"], help="media items per post (>1: carousel)")
+    parser.add_argument("--media-kb", type=int, default=DEFAULTS["media_kb"], help="size of each CDN file")
+    parser.add_argument("--seed", type=int, default=DEFAULTS["seed"])
+
+
+def fake_options(args):
+    return {name: getattr(args, name) for name in DEFAULTS}
+
+
+def describe(options):
+    return (f"upstream: latency={options['upstream_latency']}s±{options['upstream_jitter']} "
+            f"errors={options['upstream_error_rate']:.0%} "
+            f"tail={options['upstream_tail_rate']:.0%}@{options['upstream_tail_latency']}s  "
+            f"telegram: latency={options['telegram_latency']}s±{options['telegram_jitter']} "
+            f"errors={options['telegram_error_rate']:.0%} url_fetch_errors={options['url_fetch_error_rate']:.0%}  "
+            f"items={options['items']} media={options['media_kb']}KB")
+
+
+def _serve(port_queue, options):
+    async def start():
+        runner = web.AppRunner(FakeBackends(**options).app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port_queue.put(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(start())
+
+
+def start_fake_backends(**options):
+    """سرورها را در یک پروسه جدا اجرا می‌کند و (پروسه، آدرس پایه) را برمی‌گرداند"""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(port_queue, options), daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+
+
+def point_bot_at(base):
+    """آدرس upstream و Bot API را قبل از import کردن bot.py به سرورهای جعلی تغییر می‌دهد"""
+    import telebot.apihelper
+    import telebot.asyncio_helper
+
+    os.environ["FASTCREATE_API"] = f"{base}/instagram"
+    # پروسه‌های کارگر bot.py آدرس Bot API را از محیط می‌خوانند
+    os.environ["TELEGRAM_API_URL"] = base
+    telebot.apihelper.API_URL = base + "/bot{0}/{1}"
+    telebot.asyncio_helper.API_URL = base + "/bot{0}/{1}"
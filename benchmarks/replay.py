@@ -0,0 +1,177 @@
+"""
+بازپخش آپدیت‌های ضبط‌شده روی bot.py با سرورهای جعلی benchmarks/fakes.py.
+
+فایل ورودی را ربات با RECORD_UPDATES_PATH ضبط می‌کند (recorder.py). آپدیت‌ها با همان فاصله‌های
+زمانی ضبط‌شده (تقسیم بر --speed) به هندلرها داده می‌شوند؛ --speed 0 یعنی با حداکثر سرعت.
+مدیر ربات در فایل ضبط‌شده شناسه ADMIN_PSEUDONYM دارد و در بازپخش هم مدیر است.
+
+    python benchmarks/replay.py updates.rec --speed 1
+    python benchmarks/replay.py updates.rec --speed 10 --upstream-latency 1.5
+    python benchmarks/replay.py updates.rec --speed 0 --json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_e2e import current_rss_mb, peak_rss_mb, percentile, start_bot, stop_bot  # noqa: E402
+from fakes import add_fake_arguments, describe, fake_options, point_bot_at, start_fake_backends  # noqa: E402
+from recorder import ADMIN_PSEUDONYM, read_updates  # noqa: E402
+
+# همه trace های دانلود برای محاسبه تأخیر نگه داشته می‌شوند
+TRACE_BUFFER_SIZE = 1000000
+
+
+def summary(values):
+    values = sorted(values)
+    return {
+        name: round(percentile(values, p) * 1000, 1)
+        for name, p in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+    }
+
+
+async def handle(bot, update, timings):
+    started = time.perf_counter()
+    try:
+        await bot.bot.process_new_updates([update])
+    finally:
+        timings.append(time.perf_counter() - started)
+
+
+async def replay(bot, records, speed):
+    """آپدیت‌ها را طبق زمان‌بندی ضبط‌شده اجرا می‌کند و (تأخیر از برنامه، زمان هندلرها) را برمی‌گرداند"""
+    from telebot import types
+
+    lags = []
+    timings = []
+    tasks = []
+    first = records[0][0]
+    started = time.perf_counter()
+    for recorded_at, json_update in records:
+        due = started + (recorded_at - first) / speed if speed > 0 else time.perf_counter()
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lags.append(max(0.0, time.perf_counter() - due))
+        update = types.Update.de_json(json_update)
+        tasks.append(asyncio.create_task(handle(bot, update, timings)))
+    await asyncio.gather(*tasks)
+    return lags, timings
+
+
+async def drain(bot, timeout):
+    """تا پایان دانلودهای صف و ارسال‌های همگانی شروع‌شده در بازپخش صبر می‌کند"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        queue = bot.download_scheduler.stats()
+        if not queue['pending'] and not queue['running'] and not bot.broadcast_states:
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def run(args, base, records):
+    import aiohttp
+
+    bot, flusher = await start_bot()
+    baseline_rss = current_rss_mb()
+
+    async with aiohttp.ClientSession() as session:
+        await session.delete(f"{base}/_stats")
+        started = time.perf_counter()
+        lags, timings = await replay(bot, records, args.speed)
+        drained = await drain(bot, args.timeout)
+        elapsed = time.perf_counter() - started
+        async with session.get(f"{base}/_stats") as resp:
+            stats = await resp.json()
+
+    traces = bot.tracer.slowest(TRACE_BUFFER_SIZE)
+    await stop_bot(bot, flusher)
+
+    kinds = Counter(next((key for key in update if key != "update_id"), "other") for _, update in records)
+    return {
+        "updates": len(records),
+        "types": dict(kinds),
+        "captured_seconds": round(records[-1][0] - records[0][0], 3),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(records) / elapsed, 2) if elapsed else 0,
+        "drained": drained,
+        "schedule_lag_ms": summary(lags),
+        "handler_ms": summary(timings),
+        "download_ms": summary([trace.duration for trace in traces]),
+        "download_status": dict(Counter(trace.status for trace in traces)),
+        "rss_mb": {
+            "baseline": round(baseline_rss, 1),
+            "peak": round(peak_rss_mb(), 1),
+        },
+        "telegram_calls": stats["calls"],
+        "fakes": stats["counters"],
+    }
+
+
+def print_report(args, result):
+    print(f"{args.capture}: {result['updates']} updates over {result['captured_seconds']:.1f}s, "
+          f"speed={args.speed or 'max'}x")
+    print(describe(fake_options(args)))
+    print()
+    print(f"types       {', '.join(f'{k}={v}' for k, v in sorted(result['types'].items()))}")
+    print(f"replayed    in {result['seconds']:.2f}s ({result['throughput']:.1f} updates/s)"
+          f"{'' if result['drained'] else ', queue NOT drained before timeout'}")
+    for name, title in (("schedule_lag_ms", "lag"), ("handler_ms", "handlers"), ("download_ms", "downloads")):
+        values = result[name]
+        print(f"{title:<12}p50 {values['p50']:.0f} ms  p95 {values['p95']:.0f} ms  "
+              f"p99 {values['p99']:.0f} ms  max {values['max']:.0f} ms")
+    print(f"outcomes    {', '.join(f'{k}={v}' for k, v in sorted(result['download_status'].items()))}")
+    print(f"memory      baseline {result['rss_mb']['baseline']:.1f} MB  peak {result['rss_mb']['peak']:.1f} MB")
+    print(f"telegram    {', '.join(f'{m}={n}' for m, n in sorted(result['telegram_calls'].items()))}")
+    print(f"fakes       {', '.join(f'{k}={v}' for k, v in result['fakes'].items())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("capture", help="file written by the bot with RECORD_UPDATES_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier (0: as fast as possible)")
+    parser.add_argument("--skip", type=int, default=0, help="skip the first N updates")
+    parser.add_argument("--limit", type=int, default=0, help="replay at most N updates")
+    add_fake_arguments(parser)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    args = parser.parse_args()
+
+    records = list(read_updates(args.capture))[args.skip:]
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        parser.error(f"no updates in {args.capture}")
+    args.capture = os.path.abspath(args.capture)
+
+    os.environ["ADMIN_ID"] = str(ADMIN_PSEUDONYM)
+    os.environ["RECORD_UPDATES_PATH"] = ""
+    os.environ["TRACE_SLOW_MS"] = "0"
+    os.environ["TRACE_BUFFER_SIZE"] = str(TRACE_BUFFER_SIZE)
+
+    process, base = start_fake_backends(**fake_options(args))
+    try:
+        point_bot_at(base)
+        # دیتابیس، پوشه دانلود و کش دیسکی در یک پوشه موقت ساخته می‌شوند
+        os.chdir(tempfile.mkdtemp(prefix="bench_replay_"))
+        result = asyncio.run(run(args, base, records))
+    finally:
+        process.terminate()
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(args, result)
+
+
+if __name__ == "__main__":
+    main()
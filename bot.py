@@ -1,44 +1,348 @@
 import os
-import aiohttp
-import telebot
+from telebot.async_telebot import AsyncTeleBot, ExceptionHandler
+from telebot import asyncio_helper
+from telebot.asyncio_helper import ApiTelegramException
 import sqlite3
 import datetime
+import json
 from telebot import types
 from contextlib import contextmanager
-from flask import Flask
-from threading import Thread
+from aiohttp import web
 import asyncio
 import re
+import secrets
+import signal
+import sys
+import threading
+import time
+from upstream import UpstreamClient, SingleFlight, CircuitBreaker, CircuitOpen
+from cache import PostCache
+from webhook import WebhookReceiver
+from scheduler import DownloadScheduler, QueueFull, UserQueueFull
+from membership import MembershipVerifier
+from broadcast import BroadcastEngine, RateLimiter
+from links import is_instagram_url, parse_instagram_url
+from uploader import StreamingUploader, MediaTooLarge, is_file_id_error, is_url_fetch_error
+from mediacache import MediaCache
+from metrics import Registry, timed_methods
+from tracing import Tracer, activate, set_status, span
+from recorder import UpdateRecorder
+from supervisor import Supervisor, read_worker_updates, shard_for
 
-# Flask app for Railway
-app = Flask(__name__)
+# HTTP server for Railway (aiohttp, on the bot's event loop)
+routes = web.RouteTableDef()
 
-@app.route('/')
-def home():
-    return "🤖 Bot is running successfully on Railway!"
+@routes.get('/')
+async def home(request):
+    return web.Response(text="🤖 Bot is running successfully on Railway!")
 
-@app.route('/health')
-def health():
-    return "✅ Bot is healthy and running!"
+@routes.get('/health')
+async def health(request):
+    return web.Response(text="✅ Bot is healthy and running!")
+
+@routes.get('/upstream')
+async def upstream_stats(request):
+    return web.json_response(dict(
+        upstream.stats(),
+        coalescing=upstream_flights.stats(),
+        breaker=upstream_breaker.stats(),
+        hedging=upstream.hedge_stats()
+    ))
+
+@routes.get('/cache')
+async def cache_stats(request):
+    return web.json_response(post_cache.stats())
+
+@routes.get('/queue')
+async def queue_stats(request):
+    return web.json_response(download_scheduler.stats())
+
+@routes.get('/membership')
+async def membership_stats(request):
+    return web.json_response(membership_verifier.stats())
+
+@routes.get('/uploads')
+async def upload_stats(request):
+    return web.json_response(media_uploader.stats())
+
+@routes.get('/media-cache')
+async def media_cache_stats(request):
+    return web.json_response(media_cache.stats())
+
+@routes.get('/metrics')
+async def metrics(request):
+    return web.Response(
+        body=registry.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+@routes.get('/traces')
+async def traces(request):
+    # مقدار نامعتبر به پیش‌فرض برمی‌گردد؛ بیشتر از ظرفیت بافر هم معنی ندارد
+    try:
+        limit = min(max(int(request.query.get("limit", "20")), 1), TRACE_BUFFER_SIZE)
+    except ValueError:
+        limit = 20
+    return web.json_response(dict(
+        tracer.stats(),
+        traces=[trace.to_dict() for trace in tracer.slowest(limit)]
+    ))
+
+@routes.get('/ingest')
+async def ingest_stats(request):
+    return web.json_response(dict(
+        webhook_receiver.stats(),
+        mode=BOT_MODE,
+        recorder=update_recorder.stats() if update_recorder else None
+    ))
 
 # Environment variables for Railway
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "8060923799:AAFIp8yO6rFKIfSRVLIiTVfPmrhaTbZpHeg")
-FASTCREATE_API = "https://api.fast-creat.ir/instagram"
+FASTCREATE_API = os.environ.get("FASTCREATE_API", "https://api.fast-creat.ir/instagram")
 API_KEY = os.environ.get("API_KEY", "6780138150:qgQpHUsr2EXJlde@Api_ManagerRoBot")
 ADMIN_ID = int(os.environ.get("ADMIN_ID", "8024516184"))
+PORT = int(os.environ.get("PORT", 5000))
+# آدرس Bot API (مثلاً سرور محلی Bot API)؛ خالی یعنی api.telegram.org
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "")
+if TELEGRAM_API_URL:
+    asyncio_helper.API_URL = TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
+
+# حالت دریافت آپدیت: polling یا webhook
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "64"))
+
+# تعداد پروسه‌های کارگر؛ بیشتر از 1 یعنی یک پروسه ناظر آپدیت‌ها را بر اساس chat_id بین کارگرها تقسیم می‌کند
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "1"))
+BOT_WORKER_PORT_BASE = int(os.environ.get("BOT_WORKER_PORT_BASE", str(PORT + 1)))
+# فقط در پروسه‌های کارگر (توسط ناظر) تنظیم می‌شود
+BOT_WORKER_INDEX = os.environ.get("BOT_WORKER_INDEX", "")
+IS_WORKER = BOT_WORKER_INDEX != ""
+IS_SUPERVISOR = BOT_WORKERS > 1 and not IS_WORKER
+# کارهای یکتا (ادامه ارسال همگانی، بررسی دوره‌ای عضویت) فقط در یک پروسه اجرا می‌شوند:
+# کارگری که چت مدیر به آن می‌رسد، چون دکمه‌های کنترل ارسال همگانی هم همان‌جا پردازش می‌شوند
+IS_PRIMARY = not IS_WORKER or int(BOT_WORKER_INDEX) == shard_for(ADMIN_ID, BOT_WORKERS)
+
+# تنظیمات صف دانلود
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "32"))
+DOWNLOAD_QUEUE_LIMIT = int(os.environ.get("DOWNLOAD_QUEUE_LIMIT", "500"))
+DOWNLOAD_RUNNING_PER_USER = int(os.environ.get("DOWNLOAD_RUNNING_PER_USER", "2"))
+DOWNLOAD_QUEUED_PER_USER = int(os.environ.get("DOWNLOAD_QUEUED_PER_USER", "10"))
+
+# تنظیمات بررسی عضویت در کانال‌ها
+MEMBERSHIP_TTL = int(os.environ.get("MEMBERSHIP_TTL", "21600"))
+MEMBERSHIP_SWEEP_INTERVAL = int(os.environ.get("MEMBERSHIP_SWEEP_INTERVAL", "60"))
+MEMBERSHIP_SWEEP_BATCH = int(os.environ.get("MEMBERSHIP_SWEEP_BATCH", "20"))
+MEMBERSHIP_SWEEP_RATE = float(os.environ.get("MEMBERSHIP_SWEEP_RATE", "10"))
+# فاصله بررسی دوباره بعد از خطای API و مدتی که عضویت بعد از پایان TTL با خطای API معتبر می‌ماند
+MEMBERSHIP_ERROR_RETRY = int(os.environ.get("MEMBERSHIP_ERROR_RETRY", "600"))
+MEMBERSHIP_ERROR_GRACE = int(os.environ.get("MEMBERSHIP_ERROR_GRACE", "21600"))
+
+# تنظیمات ارسال همگانی (محدودیت تلگرام حدود ۳۰ پیام در ثانیه است)
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_CHUNK_SIZE = int(os.environ.get("BROADCAST_CHUNK_SIZE", "500"))
+BROADCAST_CHECKPOINT_EVERY = int(os.environ.get("BROADCAST_CHECKPOINT_EVERY", "100"))
+
+# تنظیمات نوشتن دسته‌ای در دیتابیس
+WRITE_FLUSH_INTERVAL_MS = int(os.environ.get("WRITE_FLUSH_INTERVAL_MS", "500"))
+WRITE_FLUSH_MAX_RECORDS = int(os.environ.get("WRITE_FLUSH_MAX_RECORDS", "500"))
+
+# تنظیمات اتصال به API دانلود
+UPSTREAM_POOL_LIMIT = int(os.environ.get("UPSTREAM_POOL_LIMIT", "100"))
+UPSTREAM_POOL_PER_HOST = int(os.environ.get("UPSTREAM_POOL_PER_HOST", "50"))
+UPSTREAM_DNS_TTL = int(os.environ.get("UPSTREAM_DNS_TTL", "300"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "20"))
+UPSTREAM_TOTAL_TIMEOUT = float(os.environ.get("UPSTREAM_TOTAL_TIMEOUT", "30"))
+
+# قطع‌کننده مدار upstream: با خطا یا کندی زیاد، درخواست‌ها برای مدتی بدون تماس با upstream رد می‌شوند
+BREAKER_WINDOW = int(os.environ.get("BREAKER_WINDOW", "30"))
+BREAKER_MIN_REQUESTS = int(os.environ.get("BREAKER_MIN_REQUESTS", "10"))
+BREAKER_ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_SECONDS = float(os.environ.get("BREAKER_SLOW_SECONDS", "10"))
+BREAKER_SLOW_RATE = float(os.environ.get("BREAKER_SLOW_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = int(os.environ.get("BREAKER_OPEN_SECONDS", "30"))
+
+# درخواست دوم (hedge) وقتی اولی از p95 اخیر طولانی‌تر شود؛ پاسخ سریع‌تر استفاده می‌شود
+UPSTREAM_HEDGE = os.environ.get("UPSTREAM_HEDGE", "0") == "1"
+UPSTREAM_HEDGE_MIN_DELAY_MS = int(os.environ.get("UPSTREAM_HEDGE_MIN_DELAY_MS", "200"))
+UPSTREAM_HEDGE_BUDGET = float(os.environ.get("UPSTREAM_HEDGE_BUDGET", "0.1"))
+
+# تنظیمات کش پاسخ‌های API دانلود
+POST_CACHE_MAX_ITEMS = int(os.environ.get("POST_CACHE_MAX_ITEMS", "1000"))
+POST_CACHE_DEFAULT_TTL = int(os.environ.get("POST_CACHE_DEFAULT_TTL", "3600"))
+POST_CACHE_MAX_TTL = int(os.environ.get("POST_CACHE_MAX_TTL", "86400"))
+
+# تنظیمات آپلود جریانی وقتی تلگرام نمی‌تواند فایل را از لینک CDN بگیرد
+STREAM_UPLOAD_CONCURRENCY = int(os.environ.get("STREAM_UPLOAD_CONCURRENCY", "4"))
+STREAM_UPLOAD_CHUNK_KB = int(os.environ.get("STREAM_UPLOAD_CHUNK_KB", "64"))
+STREAM_UPLOAD_TIMEOUT = int(os.environ.get("STREAM_UPLOAD_TIMEOUT", "600"))
+
+# بودجه کش دیسکی فایل‌هایی که ربات خودش آپلود کرده است
+MEDIA_CACHE_MAX_MB = int(os.environ.get("MEDIA_CACHE_MAX_MB", "1024"))
+
+# تنظیمات trace مراحل دانلود
+TRACE_SLOW_MS = int(os.environ.get("TRACE_SLOW_MS", "1000"))
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "100"))
+
+# ضبط آپدیت‌های ورودی (ناشناس‌شده) برای بازپخش با benchmarks/replay.py؛ خالی یعنی غیرفعال
+RECORD_UPDATES_PATH = os.environ.get("RECORD_UPDATES_PATH", "")
+RECORD_UPDATES_SALT = os.environ.get("RECORD_UPDATES_SALT", "")
+RECORD_UPDATES_FLUSH_INTERVAL = int(os.environ.get("RECORD_UPDATES_FLUSH_INTERVAL", "5"))
 
 BASE_DOWNLOAD_PATH = os.path.join(os.getcwd(), "downloads")
 os.makedirs(BASE_DOWNLOAD_PATH, exist_ok=True)
 
-bot = telebot.TeleBot(BOT_TOKEN)
+# متریک‌های Prometheus برای /metrics
+registry = Registry()
+UPDATES_RECEIVED = registry.counter("bot_updates_total", "Updates received from Telegram.", ("type",))
+UPSTREAM_FETCH_SECONDS = registry.histogram(
+    "bot_upstream_fetch_seconds", "Time spent fetching post data from the download API.", ("outcome",)
+)
+TELEGRAM_REQUEST_SECONDS = registry.histogram(
+    "bot_telegram_request_seconds", "Time spent in Telegram send requests.", ("method",)
+)
+DB_QUERY_SECONDS = registry.histogram(
+    "bot_db_query_seconds", "Time spent in DatabaseManager methods.", ("method",),
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+)
+ERRORS = registry.counter("bot_errors_total", "Errors by source and type.", ("source", "type"))
+
+def update_type(update):
+    if update.message:
+        return "message"
+    if update.callback_query:
+        return "callback_query"
+    return "other"
+
+# ثبت تعداد آپدیت‌ها و زمان درخواست‌های ارسال به تلگرام
+class InstrumentedTeleBot(AsyncTeleBot):
+    async def get_updates(self, offset=None, limit=None, timeout=20, allowed_updates=None, request_timeout=None):
+        json_updates = await asyncio_helper.get_updates(self.token, offset, limit, timeout, allowed_updates, request_timeout)
+        # آپدیت‌ها قبل از تبدیل به شیء telebot ضبط می‌شوند
+        if update_recorder:
+            update_recorder.record(json_updates)
+        return [types.Update.de_json(ju) for ju in json_updates]
+
+    async def process_new_updates(self, updates):
+        for update in updates:
+            UPDATES_RECEIVED.inc((update_type(update),))
+        await super().process_new_updates(updates)
+
+    async def _timed(self, method, request):
+        started = time.perf_counter()
+        try:
+            return await request
+        except Exception as e:
+            error = str(e.error_code) if isinstance(e, ApiTelegramException) else type(e).__name__
+            ERRORS.inc(("telegram", error))
+            raise
+        finally:
+            TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, (method,))
+
+    async def send_message(self, *args, **kwargs):
+        return await self._timed("sendMessage", super().send_message(*args, **kwargs))
+
+    async def send_photo(self, *args, **kwargs):
+        return await self._timed("sendPhoto", super().send_photo(*args, **kwargs))
+
+    async def send_video(self, *args, **kwargs):
+        return await self._timed("sendVideo", super().send_video(*args, **kwargs))
+
+    async def send_media_group(self, *args, **kwargs):
+        return await self._timed("sendMediaGroup", super().send_media_group(*args, **kwargs))
+
+# خطاهای هندلرها شمرده و مثل قبل در لاگ telebot ثبت می‌شوند
+class HandlerErrorCounter(ExceptionHandler):
+    async def handle(self, exception):
+        ERRORS.inc(("handler", type(exception).__name__))
+        return False
+
+bot = InstrumentedTeleBot(BOT_TOKEN, exception_handler=HandlerErrorCounter())
+upstream_breaker = CircuitBreaker(
+    window=BREAKER_WINDOW,
+    min_requests=BREAKER_MIN_REQUESTS,
+    error_rate=BREAKER_ERROR_RATE,
+    slow_seconds=BREAKER_SLOW_SECONDS,
+    slow_rate=BREAKER_SLOW_RATE,
+    open_seconds=BREAKER_OPEN_SECONDS
+)
+upstream = UpstreamClient(
+    FASTCREATE_API,
+    API_KEY,
+    limit=UPSTREAM_POOL_LIMIT,
+    limit_per_host=UPSTREAM_POOL_PER_HOST,
+    dns_ttl=UPSTREAM_DNS_TTL,
+    connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+    read_timeout=UPSTREAM_READ_TIMEOUT,
+    total_timeout=UPSTREAM_TOTAL_TIMEOUT,
+    breaker=upstream_breaker,
+    hedge=UPSTREAM_HEDGE,
+    hedge_min_delay=UPSTREAM_HEDGE_MIN_DELAY_MS / 1000,
+    hedge_budget=UPSTREAM_HEDGE_BUDGET
+)
+upstream_flights = SingleFlight()
+tracer = Tracer(slow_threshold=TRACE_SLOW_MS / 1000, buffer_size=TRACE_BUFFER_SIZE)
+update_recorder = UpdateRecorder(
+    RECORD_UPDATES_PATH,
+    admin_ids=(ADMIN_ID,),
+    salt=RECORD_UPDATES_SALT
+) if RECORD_UPDATES_PATH else None
+webhook_receiver = WebhookReceiver(
+    bot,
+    WEBHOOK_SECRET,
+    queue_size=WEBHOOK_QUEUE_SIZE,
+    workers=WEBHOOK_WORKERS,
+    recorder=update_recorder
+)
+download_scheduler = DownloadScheduler(
+    workers=DOWNLOAD_WORKERS,
+    max_queue=DOWNLOAD_QUEUE_LIMIT,
+    max_running_per_user=DOWNLOAD_RUNNING_PER_USER,
+    max_queued_per_user=DOWNLOAD_QUEUED_PER_USER
+)
 user_lang = {}
 user_states = {}
+# ارسال‌های همگانی در حال اجرا (job_id -> task) و درخواست‌های توقف آن‌ها
 broadcast_states = {}
+broadcast_stop_requests = set()
+background_tasks = set()
 
 # کلاس مدیریت دیتابیس
+# متدهایی که فقط بافر یا کش حافظه را می‌خوانند زمان‌گیری نمی‌شوند؛ کوئری‌های آن‌ها در flush و متدهای جدا ثبت می‌شوند
+@timed_methods(DB_QUERY_SECONDS, exclude=(
+    "get_connection", "close", "init_database",
+    "add_user", "update_user_language", "increment_download_count",
+    "invalidate_forced_channels", "get_forced_channels", "check_user_membership"
+))
 class DatabaseManager:
-    def __init__(self, db_name="bot_database.db"):
+    def __init__(self, db_name="bot_database.db", busy_timeout=5000, cached_statements=256, flush_max_records=500,
+                 membership_cache_size=100000, cache_sync_interval=1):
         self.db_name = db_name
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.flush_max_records = flush_max_records
+        self.membership_cache_size = membership_cache_size
+        self.cache_sync_interval = cache_sync_interval
+        # لیست کانال‌های اجباری و کاربرانی که عضویتشان تأیید شده در حافظه نگه داشته می‌شوند
+        self._forced_channels = None
+        self._verified_members = set()
+        # نسخه این کش‌ها در دیتابیس؛ تغییر آن در یک پروسه کش بقیه پروسه‌ها را هم باطل می‌کند
+        self._membership_version = None
+        self._membership_checked_at = 0
+        self._flush_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # تغییرات پرتکرار ابتدا در حافظه جمع می‌شوند و یکجا در یک تراکنش نوشته می‌شوند
+        self._pending_lock = threading.Lock()
+        self._pending_users = {}
+        self._pending_languages = {}
+        self._pending_downloads = {}
         self.init_database()
     
     def init_database(self):
@@ -65,10 +369,15 @@ class DatabaseManager:
                     date TEXT PRIMARY KEY,
                     total_users INTEGER DEFAULT 0,
                     total_downloads INTEGER DEFAULT 0,
-                    new_users INTEGER DEFAULT 0
+                    new_users INTEGER DEFAULT 0,
+                    downloads INTEGER DEFAULT 0,
+                    active_users INTEGER DEFAULT 0
                 )
             ''')
             
+            self._add_missing_column(cursor, 'statistics', 'downloads', 'INTEGER DEFAULT 0')
+            self._add_missing_column(cursor, 'statistics', 'active_users', 'INTEGER DEFAULT 0')
+            
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS forced_channels (
                     channel_id TEXT PRIMARY KEY,
@@ -82,54 +391,406 @@ class DatabaseManager:
                     user_id INTEGER,
                     channel_id TEXT,
                     joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    verified_at REAL,
                     PRIMARY KEY (user_id, channel_id)
                 )
             ''')
             
+            self._add_missing_column(cursor, 'channel_memberships', 'verified_at', 'REAL')
+            # آخرین بررسی ناموفق (خطای API)؛ verified_at فقط با تأیید واقعی تغییر می‌کند
+            self._add_missing_column(cursor, 'channel_memberships', 'checked_at', 'REAL')
+            self._add_missing_column(cursor, 'users', 'blocked_bot', 'INTEGER DEFAULT 0')
+            
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_channel_memberships_verified ON channel_memberships (verified_at)')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS upstream_cache (
+                    shortcode TEXT PRIMARY KEY,
+                    payload TEXT,
+                    expires_at REAL
+                )
+            ''')
+            
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_upstream_cache_expires ON upstream_cache (expires_at)')
+            
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_join_date ON users (join_date, user_id)')
+            
+            self._init_totals(cursor)
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS telegram_files (
+                    shortcode TEXT,
+                    item_index INTEGER,
+                    media_type TEXT,
+                    file_id TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (shortcode, item_index, media_type)
+                )
+            ''')
+            
+            # فهرست کش دیسکی رسانه‌ها؛ چند کلید می‌توانند به یک فایل (digest) اشاره کنند
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS media_files (
+                    media_key TEXT PRIMARY KEY,
+                    digest TEXT,
+                    size INTEGER,
+                    last_used REAL
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS cache_versions (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER DEFAULT 0
+                )
+            ''')
+            
+            # جدول ارسال‌های همگانی؛ last_user_id نقطه ادامه بعد از توقف یا ری‌استارت است
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    broadcast_type TEXT,
+                    text TEXT,
+                    file_id TEXT,
+                    caption TEXT,
+                    status TEXT DEFAULT 'running',
+                    last_user_id INTEGER DEFAULT 0,
+                    total INTEGER DEFAULT 0,
+                    success INTEGER DEFAULT 0,
+                    failed INTEGER DEFAULT 0,
+                    blocked INTEGER DEFAULT 0,
+                    chat_id INTEGER,
+                    status_message_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # کاربران بعد از last_user_id که پیام را گرفته‌اند (JSON)؛ بعد از ادامه دوباره ارسال نمی‌شوند
+            self._add_missing_column(cursor, 'broadcast_jobs', 'delivered_ahead', "TEXT DEFAULT '[]'")
+            
             conn.commit()
     
+    # دیتابیس‌های قدیمی ستون‌های جدید را ندارند
+    def _add_missing_column(self, cursor, table, column, definition):
+        columns = [row['name'] for row in cursor.execute(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
+    def _init_totals(self, cursor):
+        cursor.execute('SELECT 1 FROM statistics LIMIT 1')
+        if cursor.fetchone() is None:
+            self._backfill_statistics(cursor)
+    
+    def _read_totals(self, cursor):
+        # مجموع‌ها در آخرین ردیف statistics هستند؛ همه پروسه‌ها از همین ردیف می‌خوانند
+        cursor.execute('SELECT total_users, total_downloads FROM statistics ORDER BY date DESC LIMIT 1')
+        row = cursor.fetchone()
+        return {
+            'total_users': row['total_users'] if row else 0,
+            'total_downloads': row['total_downloads'] if row else 0
+        }
+    
+    def _backfill_statistics(self, cursor):
+        # فقط یک بار: ساخت آمار روزانه از روی جدول کاربران
+        cursor.execute('''
+            SELECT date(join_date) as day, COUNT(*) as new_users
+            FROM users WHERE join_date IS NOT NULL GROUP BY day ORDER BY day
+        ''')
+        total_users = 0
+        for row in cursor.fetchall():
+            total_users += row['new_users']
+            cursor.execute('''
+                INSERT OR REPLACE INTO statistics (date, total_users, total_downloads, new_users)
+                VALUES (?, ?, 0, ?)
+            ''', (row['day'], total_users, row['new_users']))
+        
+        cursor.execute('SELECT COUNT(*) as total_users, SUM(downloads_count) as total_downloads FROM users')
+        totals = cursor.fetchone()
+        if not totals['total_users']:
+            return
+        cursor.execute('SELECT COUNT(*) as active FROM users WHERE last_download >= date("now")')
+        active = cursor.fetchone()['active']
+        cursor.execute('''
+            INSERT INTO statistics (date, total_users, total_downloads, active_users)
+            VALUES (date('now'), ?, ?, ?)
+            ON CONFLICT (date) DO UPDATE SET
+                total_users = excluded.total_users,
+                total_downloads = excluded.total_downloads,
+                active_users = excluded.active_users
+        ''', (totals['total_users'], totals['total_downloads'] or 0, active))
+    
+    def _record_daily_stats(self, cursor, new_users, downloads, active_users):
+        # مجموع جدید از ردیف قبلی و همین تغییرات در همان تراکنش حساب می‌شود،
+        # پس flush پروسه‌های دیگر (BOT_WORKERS > 1) بازنویسی نمی‌شود
+        cursor.execute('''
+            INSERT INTO statistics (date, total_users, total_downloads, new_users, downloads, active_users)
+            SELECT date('now'),
+                COALESCE((SELECT total_users FROM statistics ORDER BY date DESC LIMIT 1), 0) + ?,
+                COALESCE((SELECT total_downloads FROM statistics ORDER BY date DESC LIMIT 1), 0) + ?,
+                ?, ?, ?
+            WHERE true
+            ON CONFLICT (date) DO UPDATE SET
+                total_users = excluded.total_users,
+                total_downloads = excluded.total_downloads,
+                new_users = new_users + excluded.new_users,
+                downloads = downloads + excluded.downloads,
+                active_users = active_users + excluded.active_users
+        ''', (new_users, downloads, new_users, downloads, active_users))
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+    
+    # هر thread یک اتصال ثابت دارد تا هزینه باز و بسته کردن و کش statement ها از بین نرود
     @contextmanager
     def get_connection(self):
-        conn = sqlite3.connect(self.db_name)
-        conn.row_factory = sqlite3.Row
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
         try:
             yield conn
-        finally:
-            conn.close()
+        except BaseException:
+            conn.rollback()
+            raise
+    
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.ProgrammingError:
+                    pass
+            self._connections = []
+        self._local = threading.local()
+    
+    def _pending_records(self):
+        return len(self._pending_users) + len(self._pending_languages) + len(self._pending_downloads)
+    
+    def _buffer_changed(self):
+        if self._pending_records() >= self.flush_max_records:
+            self.flush()
     
     def add_user(self, user_id, username, first_name, last_name):
+        with self._pending_lock:
+            self._pending_users.setdefault(user_id, (username, first_name, last_name))
+        self._buffer_changed()
+    
+    def update_user_language(self, user_id, language):
+        with self._pending_lock:
+            self._pending_languages[user_id] = language
+        self._buffer_changed()
+    
+    def increment_download_count(self, user_id):
+        now = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        with self._pending_lock:
+            count, _ = self._pending_downloads.get(user_id, (0, None))
+            self._pending_downloads[user_id] = (count + 1, now)
+        self._buffer_changed()
+    
+    def flush(self):
+        with self._pending_lock:
+            users = self._pending_users
+            languages = self._pending_languages
+            downloads = self._pending_downloads
+            self._pending_users = {}
+            self._pending_languages = {}
+            self._pending_downloads = {}
+        
+        if not (users or languages or downloads):
+            return 0
+        
+        try:
+            with self._flush_lock, self.get_connection() as conn:
+                cursor = conn.cursor()
+                # قفل نوشتن از ابتدا گرفته می‌شود تا خواندن مجموع‌ها و نوشتن آن‌ها با flush پروسه دیگر تداخل نکند
+                if not conn.in_transaction:
+                    cursor.execute('BEGIN IMMEDIATE')
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+                    VALUES (?, ?, ?, ?)
+                ''', [(user_id, *names) for user_id, names in users.items()])
+                inserted = max(cursor.rowcount, 0)
+                # کاربری که دوباره /start زده ربات را از حالت مسدود خارج کرده است
+                cursor.executemany('''
+                    UPDATE users SET blocked_bot = 0 WHERE user_id = ? AND blocked_bot = 1
+                ''', [(user_id,) for user_id in users])
+                cursor.executemany('''
+                    UPDATE users SET language = ? WHERE user_id = ?
+                ''', [(language, user_id) for user_id, language in languages.items()])
+                
+                # کاربرانی که امروز اولین دانلودشان است
+                newly_active = 0
+                if downloads:
+                    placeholders = ','.join('?' * len(downloads))
+                    cursor.execute(f'''
+                        SELECT COUNT(*) as fresh FROM users WHERE user_id IN ({placeholders})
+                        AND (last_download IS NULL OR last_download < date("now"))
+                    ''', list(downloads))
+                    newly_active = cursor.fetchone()['fresh']
+                
+                cursor.executemany('''
+                    UPDATE users SET 
+                    downloads_count = downloads_count + ?,
+                    last_download = ?
+                    WHERE user_id = ?
+                ''', [(count, last, user_id) for user_id, (count, last) in downloads.items()])
+                
+                self._record_daily_stats(
+                    cursor,
+                    inserted,
+                    sum(count for count, _ in downloads.values()),
+                    newly_active
+                )
+                conn.commit()
+        except sqlite3.Error:
+            # تغییرات از دست نروند و در flush بعدی دوباره نوشته شوند
+            with self._pending_lock:
+                for user_id, names in users.items():
+                    self._pending_users.setdefault(user_id, names)
+                for user_id, language in languages.items():
+                    self._pending_languages.setdefault(user_id, language)
+                for user_id, (count, last) in downloads.items():
+                    pending, newer = self._pending_downloads.get(user_id, (0, None))
+                    self._pending_downloads[user_id] = (pending + count, newer or last)
+            raise
+        
+        return len(users) + len(languages) + len(downloads)
+    
+    def get_user_stats(self, user_id):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+        
+        with self._pending_lock:
+            names = self._pending_users.get(user_id)
+            language = self._pending_languages.get(user_id)
+            downloads = self._pending_downloads.get(user_id)
+        
+        if row is None and names is None:
+            return None
+        if not (names or language or downloads):
+            return row
+        
+        # ادغام تغییرات نوشته‌نشده با رکورد دیتابیس
+        if row is not None:
+            user = dict(row)
+        else:
+            user = {
+                'user_id': user_id,
+                'username': names[0],
+                'first_name': names[1],
+                'last_name': names[2],
+                'language': 'fa',
+                'join_date': datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+                'downloads_count': 0,
+                'last_download': None,
+                'is_banned': 0,
+                'ban_reason': None
+            }
+        if language:
+            user['language'] = language
+        if downloads:
+            user['downloads_count'] += downloads[0]
+            user['last_download'] = downloads[1]
+        return user
+    
+    def count_users(self):
+        # مجموع کاربران در جدول statistics نگه داشته و با هر flush به‌روز می‌شود
+        with self.get_connection() as conn:
+            return self._read_totals(conn.cursor())['total_users']
+    
+    def get_users_page(self, cursor_key=None, direction="next", limit=10):
+        """صفحه‌بندی keyset بر اساس (join_date, user_id) به ترتیب جدیدترین کاربران"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if cursor_key is None:
+                cursor.execute('''
+                    SELECT * FROM users ORDER BY join_date DESC, user_id DESC LIMIT ?
+                ''', (limit + 1,))
+            elif direction == "next":
+                cursor.execute('''
+                    SELECT * FROM users WHERE (join_date, user_id) < (?, ?)
+                    ORDER BY join_date DESC, user_id DESC LIMIT ?
+                ''', (*cursor_key, limit + 1))
+            else:
+                cursor.execute('''
+                    SELECT * FROM users WHERE (join_date, user_id) > (?, ?)
+                    ORDER BY join_date ASC, user_id ASC LIMIT ?
+                ''', (*cursor_key, limit + 1))
+            rows = cursor.fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if direction == "prev" and cursor_key is not None:
+            rows.reverse()
+            return rows, has_more, True
+        return rows, cursor_key is not None, has_more
+    
+    def get_broadcast_recipients(self, after_user_id, limit):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name))
+                SELECT user_id FROM users
+                WHERE user_id > ? AND blocked_bot = 0
+                ORDER BY user_id LIMIT ?
+            ''', (after_user_id, limit))
+            return [row['user_id'] for row in cursor.fetchall()]
+    
+    def mark_user_blocked(self, user_id):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE users SET blocked_bot = 1 WHERE user_id = ?', (user_id,))
             conn.commit()
     
-    def update_user_language(self, user_id, language):
+    def create_broadcast_job(self, broadcast_type, text, file_id, caption, total, chat_id, status_message_id):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                UPDATE users SET language = ? WHERE user_id = ?
-            ''', (language, user_id))
+                INSERT INTO broadcast_jobs (broadcast_type, text, file_id, caption, total, chat_id, status_message_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (broadcast_type, text, file_id, caption, total, chat_id, status_message_id))
             conn.commit()
+            return cursor.lastrowid
     
-    def increment_download_count(self, user_id):
+    def get_broadcast_job(self, job_id):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM broadcast_jobs WHERE job_id = ?', (job_id,))
+            return cursor.fetchone()
+    
+    def get_broadcast_jobs(self, status):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM broadcast_jobs WHERE status = ? ORDER BY job_id', (status,))
+            return cursor.fetchall()
+    
+    def set_broadcast_status(self, job_id, status):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                UPDATE users SET 
-                downloads_count = downloads_count + 1,
-                last_download = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (user_id,))
+                UPDATE broadcast_jobs SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = ?
+            ''', (status, job_id))
             conn.commit()
     
-    def get_user_stats(self, user_id):
+    def checkpoint_broadcast_job(self, job_id, last_user_id, success, failed, blocked, delivered_ahead=()):
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            return cursor.fetchone()
+            cursor.execute('''
+                UPDATE broadcast_jobs SET
+                last_user_id = ?, success = ?, failed = ?, blocked = ?, delivered_ahead = ?,
+                updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = ?
+            ''', (last_user_id, success, failed, blocked, json.dumps(list(delivered_ahead)), job_id))
+            conn.commit()
     
     def get_all_users(self):
         with self.get_connection() as conn:
@@ -140,14 +801,32 @@ class DatabaseManager:
     def get_total_stats(self):
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) as total_users FROM users')
-            total_users = cursor.fetchone()['total_users']
+            totals = self._read_totals(cursor)
+            total_users = totals['total_users']
+            total_downloads = totals['total_downloads']
+            
+            cursor.execute('SELECT active_users FROM statistics WHERE date = date("now")')
+            row = cursor.fetchone()
+            active_today = row['active_users'] if row else 0
             
-            cursor.execute('SELECT COUNT(*) as active_today FROM users WHERE last_download >= date("now")')
-            active_today = cursor.fetchone()['active_today']
+            with self._pending_lock:
+                new_users = list(self._pending_users)
+                downloads = dict(self._pending_downloads)
             
-            cursor.execute('SELECT SUM(downloads_count) as total_downloads FROM users')
-            total_downloads = cursor.fetchone()['total_downloads'] or 0
+            # کاربران و دانلودهایی که هنوز در دیتابیس نوشته نشده‌اند
+            if new_users:
+                placeholders = ','.join('?' * len(new_users))
+                cursor.execute(f'SELECT COUNT(*) as existing FROM users WHERE user_id IN ({placeholders})', new_users)
+                total_users += len(new_users) - cursor.fetchone()['existing']
+            
+            if downloads:
+                total_downloads += sum(count for count, _ in downloads.values())
+                placeholders = ','.join('?' * len(downloads))
+                cursor.execute(
+                    f'SELECT COUNT(*) as counted FROM users WHERE user_id IN ({placeholders}) AND last_download >= date("now")',
+                    list(downloads)
+                )
+                active_today += len(downloads) - cursor.fetchone()['counted']
             
             return {
                 'total_users': total_users,
@@ -155,6 +834,14 @@ class DatabaseManager:
                 'total_downloads': total_downloads
             }
     
+    def get_daily_stats(self, days):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM statistics WHERE date > date('now', ?) ORDER BY date
+            ''', (f'-{int(days)} days',))
+            return cursor.fetchall()
+    
     def add_forced_channel(self, channel_id, channel_username, channel_title):
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -162,9 +849,47 @@ class DatabaseManager:
                 INSERT OR REPLACE INTO forced_channels (channel_id, channel_username, channel_title)
                 VALUES (?, ?, ?)
             ''', (channel_id, channel_username, channel_title))
+            self._bump_membership_version(cursor)
             conn.commit()
+        self.invalidate_forced_channels()
+    
+    def invalidate_forced_channels(self):
+        # با تغییر لیست کانال‌ها، تأییدهای قبلی دیگر کافی نیستند
+        self._forced_channels = None
+        self._verified_members = set()
+    
+    def _bump_membership_version(self, cursor):
+        cursor.execute('''
+            INSERT INTO cache_versions (name, version) VALUES ('membership', 1)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1
+        ''')
+    
+    def _sync_membership_cache(self):
+        # حداکثر هر cache_sync_interval ثانیه یک بار نسخه دیتابیس خوانده می‌شود
+        now = time.monotonic()
+        if now - self._membership_checked_at < self.cache_sync_interval:
+            return
+        self._membership_checked_at = now
+        version = self.get_cache_version('membership')
+        if version != self._membership_version:
+            self._membership_version = version
+            self.invalidate_forced_channels()
+    
+    def get_cache_version(self, name):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT version FROM cache_versions WHERE name = ?', (name,))
+            row = cursor.fetchone()
+        return row['version'] if row else 0
     
     def get_forced_channels(self):
+        self._sync_membership_cache()
+        channels = self._forced_channels
+        if channels is None:
+            channels = self._forced_channels = self.load_forced_channels()
+        return channels
+    
+    def load_forced_channels(self):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM forced_channels')
@@ -174,40 +899,277 @@ class DatabaseManager:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT OR REPLACE INTO channel_memberships (user_id, channel_id)
-                VALUES (?, ?)
+                INSERT INTO channel_memberships (user_id, channel_id, verified_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (user_id, channel_id) DO UPDATE SET verified_at = excluded.verified_at
+            ''', (user_id, channel_id, time.time()))
+            conn.commit()
+    
+    def revoke_membership(self, user_id, channel_id):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM channel_memberships WHERE user_id = ? AND channel_id = ?
             ''', (user_id, channel_id))
+            # کاربری که عضویت ثبت‌شده‌ای نداشت کش پروسه‌های دیگر را باطل نمی‌کند
+            if cursor.rowcount > 0:
+                self._bump_membership_version(cursor)
             conn.commit()
+        self._verified_members.discard(user_id)
+    
+    def mark_membership_checked(self, user_id, channel_id):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE channel_memberships SET checked_at = ? WHERE user_id = ? AND channel_id = ?
+            ''', (time.time(), user_id, channel_id))
+            conn.commit()
+    
+    def get_stale_memberships(self, verified_before, limit, checked_before=None):
+        # عضویت‌هایی که به تازگی با خطا بررسی شده‌اند تا checked_before کنار گذاشته می‌شوند
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, channel_id, verified_at FROM channel_memberships
+                WHERE (verified_at IS NULL OR verified_at < ?)
+                AND (checked_at IS NULL OR checked_at < ?)
+                AND channel_id IN (SELECT channel_id FROM forced_channels)
+                ORDER BY verified_at
+                LIMIT ?
+            ''', (verified_before, checked_before if checked_before is not None else time.time(), limit))
+            return cursor.fetchall()
     
     def check_user_membership(self, user_id):
+        channels = self.get_forced_channels()
+        if not channels:
+            return True
+        
+        if user_id in self._verified_members:
+            return True
+        
+        channel_ids = [channel['channel_id'] for channel in channels]
+        if self.count_joined_channels(user_id, channel_ids) < len(channel_ids):
+            return False
+        
+        if len(self._verified_members) >= self.membership_cache_size:
+            self._verified_members = set()
+        self._verified_members.add(user_id)
+        return True
+    
+    def count_joined_channels(self, user_id, channel_ids):
+        placeholders = ','.join('?' * len(channel_ids))
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            channels = self.get_forced_channels()
-            
-            if not channels:
-                return True
-                
-            for channel in channels:
+            cursor.execute(f'''
+                SELECT COUNT(*) as joined FROM channel_memberships
+                WHERE user_id = ? AND channel_id IN ({placeholders})
+            ''', (user_id, *channel_ids))
+            return cursor.fetchone()['joined']
+    
+    def get_cached_post(self, shortcode):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT payload, expires_at FROM upstream_cache WHERE shortcode = ?', (shortcode,))
+            return cursor.fetchone()
+    
+    def save_cached_post(self, shortcode, payload, expires_at):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO upstream_cache (shortcode, payload, expires_at)
+                VALUES (?, ?, ?)
+            ''', (shortcode, payload, expires_at))
+            conn.commit()
+    
+    def delete_cached_post(self, shortcode):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM upstream_cache WHERE shortcode = ?', (shortcode,))
+            conn.commit()
+    
+    def get_file_id(self, shortcode, item_index, media_type):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT file_id FROM telegram_files
+                WHERE shortcode = ? AND item_index = ? AND media_type = ?
+            ''', (shortcode, item_index, media_type))
+            row = cursor.fetchone()
+            return row['file_id'] if row else None
+    
+    def save_file_id(self, shortcode, item_index, media_type, file_id):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO telegram_files (shortcode, item_index, media_type, file_id)
+                VALUES (?, ?, ?, ?)
+            ''', (shortcode, item_index, media_type, file_id))
+            conn.commit()
+    
+    def get_media_files(self, prefix=""):
+        # ردیف‌های هر پروسه کارگر با پیشوند آن مشخص می‌شوند؛ بدون پیشوند یعنی ردیف‌های حالت تک‌پروسه‌ای
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if prefix:
                 cursor.execute('''
-                    SELECT 1 FROM channel_memberships 
-                    WHERE user_id = ? AND channel_id = ?
-                ''', (user_id, channel['channel_id']))
-                if not cursor.fetchone():
-                    return False
-            return True
+                    SELECT media_key, digest, size FROM media_files
+                    WHERE substr(media_key, 1, ?) = ? ORDER BY last_used
+                ''', (len(prefix), prefix))
+            else:
+                cursor.execute('''
+                    SELECT media_key, digest, size FROM media_files
+                    WHERE instr(media_key, '|') = 0 ORDER BY last_used
+                ''')
+            return cursor.fetchall()
+    
+    def save_media_file(self, media_key, digest, size, last_used):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO media_files (media_key, digest, size, last_used)
+                VALUES (?, ?, ?, ?)
+            ''', (media_key, digest, size, last_used))
+            conn.commit()
+    
+    def touch_media_file(self, media_key, last_used):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE media_files SET last_used = ? WHERE media_key = ?', (last_used, media_key))
+            conn.commit()
+    
+    def delete_media_file(self, media_key):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM media_files WHERE media_key = ?', (media_key,))
+            conn.commit()
+    
+    def delete_file_id(self, shortcode, item_index, media_type):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM telegram_files
+                WHERE shortcode = ? AND item_index = ? AND media_type = ?
+            ''', (shortcode, item_index, media_type))
+            conn.commit()
+    
+    def purge_expired_posts(self, now):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM upstream_cache WHERE expires_at <= ?', (now,))
+            conn.commit()
+            return cursor.rowcount
 
 # ایجاد نمونه دیتابیس
-db = DatabaseManager()
+db = DatabaseManager(flush_max_records=WRITE_FLUSH_MAX_RECORDS)
+db.purge_expired_posts(time.time())
+post_cache = PostCache(
+    db,
+    max_items=POST_CACHE_MAX_ITEMS,
+    default_ttl=POST_CACHE_DEFAULT_TTL,
+    max_ttl=POST_CACHE_MAX_TTL
+)
+
+membership_verifier = MembershipVerifier(
+    bot,
+    db,
+    ttl=MEMBERSHIP_TTL,
+    sweep_interval=MEMBERSHIP_SWEEP_INTERVAL,
+    sweep_batch=MEMBERSHIP_SWEEP_BATCH,
+    sweep_rate=MEMBERSHIP_SWEEP_RATE,
+    error_retry=MEMBERSHIP_ERROR_RETRY,
+    error_grace=MEMBERSHIP_ERROR_GRACE
+)
+
+# بودجه کش دیسکی بین پروسه‌های کارگر تقسیم می‌شود و هر کارگر پوشه و ردیف‌های خودش را دارد؛
+# پروسه ناظر رسانه‌ای ارسال نمی‌کند و کش ندارد
+if IS_SUPERVISOR:
+    media_cache = None
+elif IS_WORKER:
+    media_cache = MediaCache(
+        db,
+        os.path.join(BASE_DOWNLOAD_PATH, f"worker-{BOT_WORKER_INDEX}"),
+        max_bytes=MEDIA_CACHE_MAX_MB * 1024 * 1024 // BOT_WORKERS,
+        owner=f"worker-{BOT_WORKER_INDEX}"
+    )
+else:
+    media_cache = MediaCache(db, BASE_DOWNLOAD_PATH, max_bytes=MEDIA_CACHE_MAX_MB * 1024 * 1024)
+media_uploader = StreamingUploader(
+    bot,
+    upstream.get_session,
+    concurrency=STREAM_UPLOAD_CONCURRENCY,
+    chunk_size=STREAM_UPLOAD_CHUNK_KB * 1024,
+    timeout=STREAM_UPLOAD_TIMEOUT,
+    media_cache=media_cache
+)
+
+# متریک‌هایی که هنگام خواندن /metrics از آمار اجزا ساخته می‌شوند
+def cache_events():
+    post = post_cache.stats()
+    media = media_cache.stats()
+    membership = membership_verifier.stats()
+    return {
+        ("post", "memory_hit"): post['memory_hits'],
+        ("post", "disk_hit"): post['disk_hits'],
+        ("post", "miss"): post['misses'],
+        ("post", "expired"): post['expired'],
+        ("media", "hit"): media['hits'],
+        ("media", "miss"): media['misses'],
+        ("media", "eviction"): media['evictions'],
+        ("membership", "hit"): membership['cache_hits'],
+        ("membership", "miss"): membership['api_checks']
+    }
+
+def queue_depths():
+    downloads = download_scheduler.stats()
+    return {
+        ("downloads_pending",): downloads['pending'],
+        ("downloads_running",): downloads['running'],
+        ("webhook",): webhook_receiver.queue.qsize(),
+        ("uploads",): media_uploader.stats()['active'],
+        ("broadcasts",): len(broadcast_states)
+    }
+
+def download_jobs():
+    downloads = download_scheduler.stats()
+    return {(outcome,): downloads[outcome] for outcome in ('completed', 'failed', 'shed')}
+
+def webhook_updates():
+    ingest = webhook_receiver.stats()
+    return {(outcome,): ingest[outcome] for outcome in ('received', 'rejected', 'dropped', 'errors')}
+
+def breaker_state():
+    state = upstream_breaker.state
+    return {(name,): int(name == state) for name in ('closed', 'open', 'half_open')}
+
+def breaker_events():
+    breaker = upstream_breaker.stats()
+    return {(event,): breaker[event] for event in ('trips', 'rejected', 'probes')}
+
+def upstream_hedges():
+    hedging = upstream.hedge_stats()
+    return {(outcome,): hedging[outcome] for outcome in ('hedged', 'primary_wins', 'hedge_wins')}
+
+registry.callback("bot_cache_events_total", "Cache hits, misses and evictions.", "counter", ("cache", "event"), cache_events)
+registry.callback("bot_queue_depth", "Items waiting or running in each queue.", "gauge", ("queue",), queue_depths)
+registry.callback("bot_download_jobs_total", "Download jobs by outcome.", "counter", ("outcome",), download_jobs)
+registry.callback("bot_webhook_updates_total", "Webhook requests by outcome.", "counter", ("outcome",), webhook_updates)
+registry.callback("bot_upstream_breaker_state", "Current state of the upstream circuit breaker.", "gauge", ("state",), breaker_state)
+registry.callback("bot_upstream_breaker_events_total", "Circuit breaker trips, rejected requests and probes.", "counter", ("event",), breaker_events)
+registry.callback("bot_upstream_hedges_total", "Hedged upstream requests and which attempt won.", "counter", ("outcome",), upstream_hedges)
+
+broadcast_engine = BroadcastEngine(
+    db,
+    RateLimiter(BROADCAST_RATE),
+    concurrency=BROADCAST_CONCURRENCY,
+    chunk_size=BROADCAST_CHUNK_SIZE,
+    checkpoint_every=BROADCAST_CHECKPOINT_EVERY
+)
 
 # تابع بررسی عضویت
 def check_membership(user_id, chat_id=None):
     if user_id == ADMIN_ID:
         return True
     
-    forced_channels = db.get_forced_channels()
-    if not forced_channels:
-        return True
-    
     return db.check_user_membership(user_id)
 
 # تابع ایجاد کیبورد جوین اجباری
@@ -276,6 +1238,7 @@ def admin_panel(lang="en"):
             types.InlineKeyboardButton("📨 ارسال همگانی", callback_data="admin_broadcast"),
             types.InlineKeyboardButton("📢 مدیریت کانال‌ها", callback_data="admin_channels"),
             types.InlineKeyboardButton("🔄 به‌روزرسانی آمار", callback_data="admin_refresh"),
+            types.InlineKeyboardButton("📈 روند آمار", callback_data="admin_trends_7"),
             types.InlineKeyboardButton("❌ بستن", callback_data="admin_close")
         )
     else:
@@ -285,20 +1248,26 @@ def admin_panel(lang="en"):
             types.InlineKeyboardButton("📨 Broadcast", callback_data="admin_broadcast"),
             types.InlineKeyboardButton("📢 Channels Management", callback_data="admin_channels"),
             types.InlineKeyboardButton("🔄 Refresh Stats", callback_data="admin_refresh"),
+            types.InlineKeyboardButton("📈 Trends", callback_data="admin_trends_7"),
             types.InlineKeyboardButton("❌ Close", callback_data="admin_close")
         )
     
     return keyboard
 
+# کلید صفحه‌بندی در callback_data (محدودیت ۶۴ بایت): تاریخ فقط به صورت عدد
+def encode_users_cursor(user):
+    return f"{re.sub(r'[^0-9]', '', user['join_date'])}_{user['user_id']}"
+
+def decode_users_cursor(data):
+    stamp, user_id = data.split("_")
+    join_date = f"{stamp[0:4]}-{stamp[4:6]}-{stamp[6:8]} {stamp[8:10]}:{stamp[10:12]}:{stamp[12:14]}"
+    return join_date, int(user_id)
+
 # مدیریت کاربران
-def users_management_panel(page=0):
-    users = db.get_all_users()
+def users_management_panel(cursor_key=None, direction="next"):
+    page_users, has_prev, has_next = db.get_users_page(cursor_key, direction)
     keyboard = types.InlineKeyboardMarkup(row_width=2)
     
-    start_idx = page * 10
-    end_idx = start_idx + 10
-    page_users = users[start_idx:end_idx]
-    
     for user in page_users:
         username = f"@{user['username']}" if user['username'] else "No Username"
         keyboard.add(
@@ -309,10 +1278,10 @@ def users_management_panel(page=0):
         )
     
     nav_buttons = []
-    if page > 0:
-        nav_buttons.append(types.InlineKeyboardButton("⬅️ Previous", callback_data=f"users_page_{page-1}"))
-    if end_idx < len(users):
-        nav_buttons.append(types.InlineKeyboardButton("Next ➡️", callback_data=f"users_page_{page+1}"))
+    if page_users and has_prev:
+        nav_buttons.append(types.InlineKeyboardButton("⬅️ Previous", callback_data=f"users_prev_{encode_users_cursor(page_users[0])}"))
+    if page_users and has_next:
+        nav_buttons.append(types.InlineKeyboardButton("Next ➡️", callback_data=f"users_next_{encode_users_cursor(page_users[-1])}"))
     
     if nav_buttons:
         keyboard.row(*nav_buttons)
@@ -320,6 +1289,61 @@ def users_management_panel(page=0):
     keyboard.add(types.InlineKeyboardButton("🔙 Back to Admin", callback_data="admin_back"))
     return keyboard
 
+# پنل روند آمار روزانه
+def trends_panel():
+    keyboard = types.InlineKeyboardMarkup(row_width=3)
+    keyboard.add(
+        types.InlineKeyboardButton("7 days", callback_data="admin_trends_7"),
+        types.InlineKeyboardButton("30 days", callback_data="admin_trends_30"),
+        types.InlineKeyboardButton("90 days", callback_data="admin_trends_90")
+    )
+    keyboard.add(types.InlineKeyboardButton("🔙 Back to Admin", callback_data="admin_back"))
+    return keyboard
+
+def trends_text(days):
+    rows = db.get_daily_stats(days)
+    new_users = sum(row['new_users'] for row in rows)
+    downloads = sum(row['downloads'] for row in rows)
+    active = sum(row['active_users'] for row in rows)
+    
+    text = f"📈 **Trends - last {days} days**\n\n"
+    text += f"👥 New Users: {new_users}\n"
+    text += f"📥 Downloads: {downloads} ({downloads / days:.1f}/day)\n"
+    text += f"🔥 Avg Active Users/day: {active / days:.1f}\n\n"
+    
+    # برای بازه‌های طولانی آمار هفتگی نمایش داده می‌شود تا پیام کوتاه بماند؛
+    # هفته‌ها بر اساس تاریخ تقویمی هستند چون روزهای بدون فعالیت ردیفی ندارند
+    bucket = 1 if days <= 7 else 7
+    start = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=days - 1)
+    groups = {}
+    for row in rows:
+        offset = (datetime.date.fromisoformat(row['date']) - start).days // bucket
+        groups.setdefault(offset, []).append(row)
+    for offset, group in groups.items():
+        label = group[0]['date'] if bucket == 1 else f"{start + datetime.timedelta(days=offset * bucket)}+"
+        text += (
+            f"{label}: 👥 {sum(row['new_users'] for row in group)}"
+            f" · 📥 {sum(row['downloads'] for row in group)}"
+            f" · 🔥 {max(row['active_users'] for row in group)}\n"
+        )
+    if not rows:
+        text += "No data yet.\n"
+    return text
+
+# خلاصه کندترین trace ها با زمان هر مرحله
+def traces_text(limit=5):
+    slowest = tracer.slowest(limit)
+    text = f"🐢 Slowest downloads (over {TRACE_SLOW_MS} ms)\n\n"
+    if not slowest:
+        return text + "No slow requests recorded."
+    for trace in slowest:
+        text += f"#{trace.trace_id} user {trace.user_id} {trace.shortcode}: {trace.duration:.2f}s ({trace.status})\n"
+        for name, offset, duration, error in trace.spans:
+            text += f"  {name}: {duration * 1000:.0f} ms"
+            text += f" ⚠️ {error}\n" if error else "\n"
+        text += "\n"
+    return text
+
 # پنل ارسال همگانی
 def broadcast_panel():
     keyboard = types.InlineKeyboardMarkup(row_width=2)
@@ -331,28 +1355,21 @@ def broadcast_panel():
     )
     return keyboard
 
-# تابع بررسی لینک اینستاگرام
-def is_instagram_url(url):
-    """بررسی می‌کند که آیا متن ارسالی یک لینک معتبر اینستاگرام است"""
-    if not url:
-        return False
-    
-    # الگوهای لینک اینستاگرام
-    patterns = [
-        r'https?://(www\.)?instagram\.com/(p|reel|stories)/[^/]+/?',
-        r'https?://(www\.)?instagram\.com/(p|reel)/[^/]+/?',
-        r'https?://(www\.)?instagram\.com/stories/[^/]+/\d+/?'
-    ]
-    
-    for pattern in patterns:
-        if re.match(pattern, url.strip()):
-            return True
-    
-    return False
+# دکمه‌های کنترل یک ارسال همگانی
+def broadcast_controls(job_id, status):
+    if status not in ("running", "paused"):
+        return None
+    keyboard = types.InlineKeyboardMarkup(row_width=2)
+    if status == "running":
+        toggle = types.InlineKeyboardButton("⏸ Pause", callback_data=f"bjob_pause_{job_id}")
+    else:
+        toggle = types.InlineKeyboardButton("▶️ Resume", callback_data=f"bjob_resume_{job_id}")
+    keyboard.add(toggle, types.InlineKeyboardButton("⛔ Cancel", callback_data=f"bjob_cancel_{job_id}"))
+    return keyboard
 
 # هندلر استارت
 @bot.message_handler(commands=['start'])
-def start(message):
+async def start(message):
     user_id = message.from_user.id
     
     db.add_user(
@@ -364,7 +1381,7 @@ def start(message):
     
     if not check_membership(user_id):
         lang = user_lang.get(user_id, "fa")
-        bot.send_message(
+        await bot.send_message(
             message.chat.id,
             membership_required_message(lang),
             reply_markup=create_membership_keyboard()
@@ -377,7 +1394,7 @@ def start(message):
     btn_close = types.InlineKeyboardButton("❌ Close", callback_data="close")
     keyboard.add(btn_fa, btn_en, btn_close)
     
-    bot.send_message(
+    await bot.send_message(
         message.chat.id,
         "لطفاً زبان خود را انتخاب کنید:\nPlease select your language:",
         reply_markup=keyboard
@@ -385,9 +1402,9 @@ def start(message):
 
 # هندلر ادمین
 @bot.message_handler(commands=['admin'])
-def admin_command(message):
+async def admin_command(message):
     if message.from_user.id != ADMIN_ID:
-        bot.reply_to(message, "⛔️ You are not authorized.")
+        await bot.reply_to(message, "⛔️ You are not authorized.")
         return
     
     stats = db.get_total_stats()
@@ -400,16 +1417,25 @@ def admin_command(message):
 
 Select an option below:
     """
-    bot.reply_to(message, admin_text, reply_markup=admin_panel())
+    await bot.reply_to(message, admin_text, reply_markup=admin_panel())
+
+# هندلر نمایش کندترین درخواست‌های دانلود
+@bot.message_handler(commands=['traces'])
+async def traces_command(message):
+    if message.from_user.id != ADMIN_ID:
+        await bot.reply_to(message, "⛔️ You are not authorized.")
+        return
+    
+    await bot.reply_to(message, traces_text())
 
 # هندلر افزودن کانال
 @bot.message_handler(commands=['addchannel'])
-def add_channel_command(message):
+async def add_channel_command(message):
     if message.from_user.id != ADMIN_ID:
         return
     
     if not message.reply_to_message or not message.reply_to_message.forward_from_chat:
-        bot.reply_to(message, "❌ Please forward a message from the channel you want to add.")
+        await bot.reply_to(message, "❌ Please forward a message from the channel you want to add.")
         return
     
     channel = message.reply_to_message.forward_from_chat
@@ -419,15 +1445,15 @@ def add_channel_command(message):
         channel_title=channel.title
     )
     
-    bot.reply_to(message, f"✅ Channel '{channel.title}' added to forced channels!")
+    await bot.reply_to(message, f"✅ Channel '{channel.title}' added to forced channels!")
 
 # هندلر کلیک‌ها
 @bot.callback_query_handler(func=lambda call: True)
-def handle_callback(call):
+async def handle_callback(call):
     user_id = call.from_user.id
     
     if call.data == "close":
-        bot.edit_message_text(
+        await bot.edit_message_text(
             f"❈ Closed By {call.from_user.first_name}!",
             call.message.chat.id,
             call.message.message_id
@@ -437,7 +1463,7 @@ def handle_callback(call):
     if call.data == "lang_fa":
         user_lang[user_id] = "fa"
         db.update_user_language(user_id, "fa")
-        bot.edit_message_text(
+        await bot.edit_message_text(
             "✅ زبان شما روی فارسی تنظیم شد.",
             call.message.chat.id,
             call.message.message_id,
@@ -448,7 +1474,7 @@ def handle_callback(call):
     if call.data == "lang_en":
         user_lang[user_id] = "en"
         db.update_user_language(user_id, "en")
-        bot.edit_message_text(
+        await bot.edit_message_text(
             "✅ Your language has been set to English.",
             call.message.chat.id,
             call.message.message_id,
@@ -457,19 +1483,7 @@ def handle_callback(call):
         return
 
     if call.data == "check_membership":
-        forced_channels = db.get_forced_channels()
-        all_joined = True
-        
-        for channel in forced_channels:
-            try:
-                chat_member = bot.get_chat_member(channel['channel_id'], user_id)
-                if chat_member.status in ['member', 'administrator', 'creator']:
-                    db.verify_membership(user_id, channel['channel_id'])
-                else:
-                    all_joined = False
-            except Exception as e:
-                print(f"Error checking membership: {e}")
-                all_joined = False
+        all_joined = await membership_verifier.verify(user_id, db.get_forced_channels())
         
         if all_joined:
             lang = user_lang.get(user_id, "fa")
@@ -478,14 +1492,14 @@ def handle_callback(call):
             else:
                 success_msg = "✅ Membership verified! You can now use the bot."
             
-            bot.edit_message_text(
+            await bot.edit_message_text(
                 success_msg,
                 call.message.chat.id,
                 call.message.message_id,
                 reply_markup=main_menu(lang)
             )
         else:
-            bot.answer_callback_query(
+            await bot.answer_callback_query(
                 call.id,
                 "❌ You haven't joined all channels yet!",
                 show_alert=True
@@ -496,7 +1510,7 @@ def handle_callback(call):
 
     if call.data == "download":
         if not check_membership(user_id):
-            bot.edit_message_text(
+            await bot.edit_message_text(
                 membership_required_message(lang),
                 call.message.chat.id,
                 call.message.message_id,
@@ -508,7 +1522,7 @@ def handle_callback(call):
             text = "🤖 ربات آماده است!\nلینک پست اینستاگرام خود را ارسال کنید:"
         else:
             text = "🤖 Bot is ready!\nPlease send your Instagram post link:"
-        bot.edit_message_text(
+        await bot.edit_message_text(
             text,
             call.message.chat.id,
             call.message.message_id
@@ -536,7 +1550,7 @@ def handle_callback(call):
                 "⚙️ Note: Private posts cannot be downloaded.\n"
                 "🧩 For any issues, contact support."
             )
-        bot.edit_message_text(
+        await bot.edit_message_text(
             text,
             call.message.chat.id,
             call.message.message_id,
@@ -546,7 +1560,7 @@ def handle_callback(call):
 
     if call.data == "about":
         text = "🤖 This bot is developed by @twexity\nDesigned to download Instagram media quickly and safely."
-        bot.edit_message_text(
+        await bot.edit_message_text(
             text,
             call.message.chat.id,
             call.message.message_id,
@@ -569,7 +1583,7 @@ def handle_callback(call):
                 "2. Misuse will result in a permanent ban.\n"
                 "3. By using the bot, you agree to Telegram and Instagram terms."
             )
-        bot.edit_message_text(
+        await bot.edit_message_text(
             text,
             call.message.chat.id,
             call.message.message_id,
@@ -580,11 +1594,12 @@ def handle_callback(call):
     # هندلرهای ادمین
     if call.data.startswith("admin"):
         if user_id != ADMIN_ID:
-            bot.answer_callback_query(call.id, "⛔️ Access denied!")
+            await bot.answer_callback_query(call.id, "⛔️ Access denied!")
             return
         
         if call.data == "admin_stats":
             stats = db.get_total_stats()
+            average = stats['total_downloads'] / stats['total_users'] if stats['total_users'] > 0 else 0
             stats_text = f"""
 📊 **Detailed Statistics**
 
@@ -594,11 +1609,11 @@ def handle_callback(call):
 
 📥 Downloads:
 • Total: {stats['total_downloads']}
-• Average per User: {stats['total_downloads']/stats['total_users']:.1f if stats['total_users'] > 0 else 0}
+• Average per User: {average:.1f}
 
 🕒 Last Update: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
             """
-            bot.edit_message_text(
+            await bot.edit_message_text(
                 stats_text,
                 call.message.chat.id,
                 call.message.message_id,
@@ -607,9 +1622,8 @@ def handle_callback(call):
             return
         
         elif call.data == "admin_users":
-            users = db.get_all_users()
-            users_text = f"👥 **Users Management**\nTotal Users: {len(users)}\n\nSelect a user to manage:"
-            bot.edit_message_text(
+            users_text = f"👥 **Users Management**\nTotal Users: {db.count_users()}\n\nSelect a user to manage:"
+            await bot.edit_message_text(
                 users_text,
                 call.message.chat.id,
                 call.message.message_id,
@@ -618,7 +1632,7 @@ def handle_callback(call):
             return
         
         elif call.data == "admin_broadcast":
-            bot.edit_message_text(
+            await bot.edit_message_text(
                 "📨 **Broadcast Message**\nSelect message type:",
                 call.message.chat.id,
                 call.message.message_id,
@@ -638,7 +1652,7 @@ def handle_callback(call):
             
             channels_text += "\nUse /addchannel to add a new channel."
             
-            bot.edit_message_text(
+            await bot.edit_message_text(
                 channels_text,
                 call.message.chat.id,
                 call.message.message_id,
@@ -647,8 +1661,8 @@ def handle_callback(call):
             return
         
         elif call.data == "admin_refresh":
-            bot.answer_callback_query(call.id, "🔄 Statistics refreshed!")
-            admin_command(call.message)
+            await bot.answer_callback_query(call.id, "🔄 Statistics refreshed!")
+            await admin_command(call.message)
             return
         
         elif call.data == "admin_back":
@@ -662,7 +1676,7 @@ def handle_callback(call):
 
 Select an option below:
             """
-            bot.edit_message_text(
+            await bot.edit_message_text(
                 admin_text,
                 call.message.chat.id,
                 call.message.message_id,
@@ -670,20 +1684,34 @@ Select an option below:
             )
             return
         
+        elif call.data.startswith("admin_trends_"):
+            days = int(call.data.split("_")[2])
+            await bot.edit_message_text(
+                trends_text(days),
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=trends_panel()
+            )
+            return
+        
         elif call.data == "admin_close":
-            bot.delete_message(call.message.chat.id, call.message.message_id)
+            await bot.delete_message(call.message.chat.id, call.message.message_id)
             return
 
     # هندلر صفحه‌بندی کاربران
-    if call.data.startswith("users_page_"):
-        page = int(call.data.split("_")[2])
-        users = db.get_all_users()
-        users_text = f"👥 **Users Management**\nTotal Users: {len(users)}\n\nSelect a user to manage:"
-        bot.edit_message_text(
+    if call.data.startswith(("users_next_", "users_prev_")):
+        if user_id != ADMIN_ID:
+            await bot.answer_callback_query(call.id, "⛔️ Access denied!")
+            return
+        
+        direction = "next" if call.data.startswith("users_next_") else "prev"
+        cursor_key = decode_users_cursor(call.data[len("users_next_"):])
+        users_text = f"👥 **Users Management**\nTotal Users: {db.count_users()}\n\nSelect a user to manage:"
+        await bot.edit_message_text(
             users_text,
             call.message.chat.id,
             call.message.message_id,
-            reply_markup=users_management_panel(page)
+            reply_markup=users_management_panel(cursor_key, direction)
         )
         return
 
@@ -704,8 +1732,8 @@ Select an option below:
 📅 Joined: {user['join_date']}
 🕒 Last Active: {user['last_download'] or 'Never'}
             """
-            bot.answer_callback_query(call.id, "User details loaded!")
-            bot.edit_message_text(
+            await bot.answer_callback_query(call.id, "User details loaded!")
+            await bot.edit_message_text(
                 user_text,
                 call.message.chat.id,
                 call.message.message_id,
@@ -713,136 +1741,579 @@ Select an option below:
             )
         return
 
+    # کنترل ارسال همگانی: توقف موقت، ادامه و لغو
+    if call.data.startswith("bjob_"):
+        if user_id != ADMIN_ID:
+            await bot.answer_callback_query(call.id, "⛔️ Access denied!")
+            return
+        
+        _, action, job_id = call.data.split("_")
+        job_id = int(job_id)
+        job = db.get_broadcast_job(job_id)
+        if not job or job['status'] not in ("running", "paused"):
+            await bot.answer_callback_query(call.id, "This broadcast has already finished.")
+            return
+        
+        if action == "pause" and job['status'] == "running":
+            db.set_broadcast_status(job_id, "paused")
+            broadcast_stop_requests.add(job_id)
+            await bot.answer_callback_query(call.id, "⏸ Pausing broadcast...")
+        elif action == "resume" and job['status'] == "paused":
+            if job_id in broadcast_states:
+                await bot.answer_callback_query(call.id, "⏳ Broadcast is still pausing, try again.")
+                return
+            db.set_broadcast_status(job_id, "running")
+            start_broadcast_job(job_id)
+            await bot.answer_callback_query(call.id, "▶️ Broadcast resumed!")
+        elif action == "cancel":
+            db.set_broadcast_status(job_id, "cancelled")
+            if job_id in broadcast_states:
+                broadcast_stop_requests.add(job_id)
+            else:
+                await bot.edit_message_text(
+                    broadcast_progress_text(job_id, job, job['total'], "cancelled"),
+                    call.message.chat.id,
+                    call.message.message_id
+                )
+            await bot.answer_callback_query(call.id, "⛔ Broadcast cancelled!")
+        else:
+            await bot.answer_callback_query(call.id)
+        return
+
     # هندلرهای ارسال همگانی
     if call.data.startswith("broadcast_"):
         if user_id != ADMIN_ID:
-            bot.answer_callback_query(call.id, "⛔️ Access denied!")
+            await bot.answer_callback_query(call.id, "⛔️ Access denied!")
             return
         
         broadcast_type = call.data.replace("broadcast_", "")
         user_states[user_id] = f"broadcast_{broadcast_type}"
         
         if broadcast_type == "text":
-            bot.edit_message_text(
+            await bot.edit_message_text(
                 "📝 **Text Broadcast**\n\nPlease send the text message you want to broadcast:",
                 call.message.chat.id,
                 call.message.message_id
             )
         elif broadcast_type == "photo":
-            bot.edit_message_text(
+            await bot.edit_message_text(
                 "🖼 **Photo Broadcast**\n\nPlease send the photo with caption you want to broadcast:",
                 call.message.chat.id,
                 call.message.message_id
             )
         elif broadcast_type == "video":
-            bot.edit_message_text(
+            await bot.edit_message_text(
                 "🎥 **Video Broadcast**\n\nPlease send the video with caption you want to broadcast:",
                 call.message.chat.id,
                 call.message.message_id
             )
         return
 
+def is_broadcasting(user_id):
+    """مدیر منتظر ارسال محتوای پیام همگانی است"""
+    return user_id == ADMIN_ID and user_states.get(user_id, "").startswith("broadcast_")
+
 # هندلر پیام‌های متنی - فقط به لینک اینستاگرام پاسخ می‌دهد
-@bot.message_handler(func=lambda message: message.text and is_instagram_url(message.text))
-def handle_instagram_url(message):
+# (متن پیام همگانی مدیر حتی اگر لینک اینستاگرام داشته باشد به هندلر پیام همگانی می‌رسد)
+@bot.message_handler(func=lambda message: not is_broadcasting(message.from_user.id) and is_instagram_url(message.text))
+async def handle_instagram_url(message):
     user_id = message.from_user.id
+    link = parse_instagram_url(message.text)
+    trace = tracer.start(user_id, link.shortcode)
     
-    if not check_membership(user_id):
-        lang = user_lang.get(user_id, "fa")
-        bot.reply_to(
-            message,
-            membership_required_message(lang),
-            reply_markup=create_membership_keyboard()
-        )
-        return
+    with activate(trace):
+        with span("membership"):
+            is_member = check_membership(user_id)
+        if not is_member:
+            lang = user_lang.get(user_id, "fa")
+            await bot.reply_to(
+                message,
+                membership_required_message(lang),
+                reply_markup=create_membership_keyboard()
+            )
+            tracer.finish(trace, "not_member")
+            return
 
-    url = message.text.strip()
-    
-    bot.reply_to(message, "⏳ Downloading content, please wait...")
-    db.increment_download_count(user_id)
+        try:
+            enqueued = time.perf_counter()
+            position = await download_scheduler.submit(
+                user_id,
+                lambda: process_download(message, link, trace, enqueued)
+            )
+        except UserQueueFull:
+            tracer.finish(trace, "user_queue_full")
+            await bot.reply_to(message, "⚠️ You already have several links in the queue. Please wait for them to finish.")
+            return
+        except QueueFull:
+            tracer.finish(trace, "queue_full")
+            await bot.reply_to(message, "🚦 The bot is very busy right now. Please try again in a few minutes.")
+            return
+
+        if position:
+            await bot.reply_to(message, f"🕒 You are #{position} in the queue. Your download will start soon.")
 
-    # استفاده از asyncio برای اجرای تابع دانلود
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(download_instagram_content(message.chat.id, url))
-    loop.close()
+# اجرای یک دانلود توسط worker های زمان‌بند
+async def process_download(message, link, trace, enqueued):
+    trace.record("queue_wait", enqueued)
+    with activate(trace):
+        try:
+            with span("reply"):
+                await bot.reply_to(message, "⏳ Downloading content, please wait...")
+            with span("increment_download_count"):
+                db.increment_download_count(message.from_user.id)
+
+            await download_instagram_content(message.chat.id, link)
+        finally:
+            tracer.finish(trace)
 
 # هندلر پیام‌های غیر لینک - فقط برای ادمین در حالت broadcast پاسخ می‌دهد
 @bot.message_handler(func=lambda message: True, content_types=['text', 'photo', 'video'])
-def handle_other_messages(message):
+async def handle_other_messages(message):
     user_id = message.from_user.id
     
     # فقط اگر ادمین در حالت broadcast باشد پاسخ می‌دهد
-    if user_id == ADMIN_ID and user_id in user_states and user_states[user_id].startswith("broadcast_"):
-        broadcast_type = user_states[user_id].replace("broadcast_", "")
-        users = db.get_all_users()
-        
-        bot.reply_to(message, f"🚀 Starting broadcast to {len(users)} users...")
-        
-        success = 0
-        failed = 0
+    if is_broadcasting(user_id):
+        broadcast_type = user_states.pop(user_id).replace("broadcast_", "")
+        content = broadcast_content(message, broadcast_type)
+        if content is None:
+            await bot.reply_to(message, f"❌ Expected a {broadcast_type} message. Broadcast cancelled.")
+            return
         
-        for user in users:
-            try:
-                if broadcast_type == "text":
-                    bot.send_message(user['user_id'], message.text)
-                elif broadcast_type == "photo" and message.photo:
-                    bot.send_photo(user['user_id'], message.photo[-1].file_id, caption=message.caption)
-                elif broadcast_type == "video" and message.video:
-                    bot.send_video(user['user_id'], message.video.file_id, caption=message.caption)
-                
-                success += 1
-            except Exception as e:
-                failed += 1
-                print(f"Failed to send to {user['user_id']}: {e}")
+        # کاربران جدید بافر شده هم باید پیام را دریافت کنند
+        db.flush()
+        total = db.count_users()
+        status = await bot.reply_to(message, f"🚀 Starting broadcast to {total} users...")
         
-        del user_states[user_id]
-        bot.reply_to(message, f"✅ Broadcast completed!\nSuccess: {success}\nFailed: {failed}")
+        # ارسال در پس‌زمینه انجام می‌شود تا هندلر آزاد بماند
+        job_id = db.create_broadcast_job(broadcast_type, *content, total, status.chat.id, status.message_id)
+        start_broadcast_job(job_id)
         return
     
     # برای کاربران عادی به پیام‌های غیر لینک پاسخ نمی‌دهد
     if user_id != ADMIN_ID:
         return
 
+# محتوای پیام همگانی (text, file_id, caption) برای ذخیره در دیتابیس
+def broadcast_content(message, broadcast_type):
+    if broadcast_type == "text" and message.text:
+        return message.text, None, None
+    if broadcast_type == "photo" and message.photo:
+        return None, message.photo[-1].file_id, message.caption
+    if broadcast_type == "video" and message.video:
+        return None, message.video.file_id, message.caption
+    return None
+
+# ساخت تابع ارسال بر اساس نوع پیام همگانی
+def broadcast_sender(job):
+    async def send(chat_id):
+        if job['broadcast_type'] == "text":
+            await bot.send_message(chat_id, job['text'])
+        elif job['broadcast_type'] == "photo":
+            await bot.send_photo(chat_id, job['file_id'], caption=job['caption'])
+        elif job['broadcast_type'] == "video":
+            await bot.send_video(chat_id, job['file_id'], caption=job['caption'])
+    return send
+
+def broadcast_progress_text(job_id, stats, total, status="running"):
+    done = stats['success'] + stats['failed'] + stats['blocked']
+    titles = {
+        "running": "📨 Broadcasting...",
+        "paused": "⏸ Broadcast paused",
+        "cancelled": "⛔ Broadcast cancelled",
+        "completed": "✅ Broadcast completed!"
+    }
+    return (
+        f"{titles[status]} #{job_id} {done}/{total}\n"
+        f"✅ Success: {stats['success']}\n"
+        f"❌ Failed: {stats['failed']}\n"
+        f"🚫 Blocked: {stats['blocked']}"
+    )
+
+def start_broadcast_job(job_id):
+    broadcast_stop_requests.discard(job_id)
+    task = asyncio.create_task(run_broadcast_job(job_id))
+    broadcast_states[job_id] = task
+    task.add_done_callback(lambda _: broadcast_states.pop(job_id, None))
+
+async def run_broadcast_job(job_id):
+    job = db.get_broadcast_job(job_id)
+    # شمارنده‌های ذخیره‌شده از اجراهای قبلی همین ارسال
+    base = {key: job[key] for key in ('success', 'failed', 'blocked')}
+    
+    def totals(stats):
+        return {key: base[key] + stats[key] for key in base}
+    
+    def checkpoint(last_user_id, stats, ahead):
+        db.checkpoint_broadcast_job(job_id, last_user_id, delivered_ahead=ahead, **totals(stats))
+    
+    async def update_status(stats, status):
+        try:
+            await bot.edit_message_text(
+                broadcast_progress_text(job_id, totals(stats), job['total'], status),
+                job['chat_id'],
+                job['status_message_id'],
+                reply_markup=broadcast_controls(job_id, status)
+            )
+        except ApiTelegramException as e:
+            print(f"Broadcast progress error: {e}")
+    
+    # نمایش دکمه‌های کنترل از همان ابتدا
+    await update_status(dict.fromkeys(base, 0), "running")
+    try:
+        stats, stopped = await broadcast_engine.run(
+            broadcast_sender(job),
+            lambda stats: update_status(stats, "running"),
+            after_user_id=job['last_user_id'],
+            on_checkpoint=checkpoint,
+            should_stop=lambda: job_id in broadcast_stop_requests,
+            skip=json.loads(job['delivered_ahead'] or '[]')
+        )
+    except Exception as e:
+        ERRORS.inc(("broadcast", type(e).__name__))
+        print(f"Broadcast #{job_id} error: {e}")
+        # بدون task در حال اجرا، وضعیت running باعث می‌شد دکمه‌ها کار نکنند؛ ادمین می‌تواند ادامه دهد
+        db.set_broadcast_status(job_id, "paused")
+        job = db.get_broadcast_job(job_id)
+        await update_status({key: job[key] - base[key] for key in base}, "paused")
+        await bot.send_message(job['chat_id'], f"⚠️ Broadcast #{job_id} stopped because of an error and was paused. Use Resume to continue.")
+        return
+    finally:
+        broadcast_stop_requests.discard(job_id)
+    
+    if stopped:
+        status = db.get_broadcast_job(job_id)['status']
+        # در حال خاموش شدن: وضعیت running می‌ماند تا بعد از ری‌استارت ادامه پیدا کند
+        if status != "running":
+            await update_status(stats, status)
+        return
+    
+    db.set_broadcast_status(job_id, "completed")
+    await update_status(stats, "completed")
+    final = totals(stats)
+    await bot.send_message(
+        job['chat_id'],
+        f"✅ Broadcast completed!\nSuccess: {final['success']}\nFailed: {final['failed']}\nBlocked: {final['blocked']}"
+    )
+
+# دریافت اطلاعات پست از upstream و ذخیره در کش
+async def fetch_and_cache_post(link):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        data = await upstream.fetch_post(link.url)
+        outcome = "ok" if data.get("ok") else "not_ok"
+    except CircuitOpen:
+        outcome = "rejected"
+        raise
+    finally:
+        UPSTREAM_FETCH_SECONDS.observe(time.perf_counter() - started, (outcome,))
+    if data.get("ok") and data["result"].get("result"):
+        post_cache.set(link.key, data)
+    return data
+
+# دریافت اطلاعات پست با استفاده از کش و ادغام درخواست‌های همزمان
+async def fetch_post_data(link):
+    with span("cache_lookup"):
+        data = post_cache.get(link.key)
+    if data is not None:
+        return data
+
+    with span("fetch"):
+        return await upstream_flights.do(link.key, lambda: fetch_and_cache_post(link))
+
+# file_id رسانه‌ای که تلگرام برای پیام ارسال‌شده برگردانده است
+def sent_file_id(sent, media_type):
+    if media_type == "video":
+        return sent.video.file_id if sent.video else None
+    return sent.photo[-1].file_id if sent.photo else None
+
+# ارسال یک فایل ویدیو یا عکس و برگرداندن file_id آن
+async def send_media_file(chat_id, media_type, media, caption):
+    with span(f"send_{media_type}"):
+        if media_type == "video":
+            sent = await bot.send_video(chat_id, video=media, caption=caption)
+        else:
+            sent = await bot.send_photo(chat_id, photo=media, caption=caption)
+    return sent_file_id(sent, media_type)
+
+# ارسال رسانه با استفاده مجدد از file_id ذخیره‌شده تا تلگرام فایل را دوباره دریافت نکند
+async def send_media(chat_id, key, item_index, media_type, url, caption):
+    file_id = db.get_file_id(key, item_index, media_type)
+    if file_id:
+        try:
+            await send_media_file(chat_id, media_type, file_id, caption)
+            return
+        except ApiTelegramException as e:
+            # file_id نامعتبر یا منقضی شده است؛ خطاهای دیگر (مثلاً caption طولانی) ربطی به file_id ندارند
+            if not is_file_id_error(e):
+                raise
+            db.delete_file_id(key, item_index, media_type)
+
+    cache_key = f"{key}/{item_index}/{media_type}"
+    if media_cache.contains(cache_key):
+        # تلگرام قبلاً نتوانسته بود این فایل را از CDN بگیرد؛ نسخه روی دیسک آپلود می‌شود
+        with span("stream_upload"):
+            sent = await media_uploader.send(chat_id, media_type, url, caption, cache_key)
+        file_id = sent_file_id(sent, media_type)
+    else:
+        try:
+            file_id = await send_media_file(chat_id, media_type, url, caption)
+        except ApiTelegramException as e:
+            if not is_url_fetch_error(e):
+                raise
+            # تلگرام نتوانست فایل را از CDN دریافت کند؛ ربات خودش فایل را آپلود می‌کند
+            with span("stream_upload"):
+                sent = await media_uploader.send(chat_id, media_type, url, caption, cache_key)
+            file_id = sent_file_id(sent, media_type)
+    if file_id:
+        db.save_file_id(key, item_index, media_type, file_id)
+
+# آیتم‌های قابل ارسال یک پست به صورت (item_index, media_type, url)
+def media_items(results):
+    items = []
+    for index, item in enumerate(results):
+        if item.get("is_video") and item.get("video_url"):
+            items.append((index, "video", item["video_url"]))
+        elif item.get("display_url"):
+            items.append((index, "photo", item["display_url"]))
+    return items
+
+# حداکثر تعداد آیتم در یک آلبوم تلگرام
+MEDIA_GROUP_LIMIT = 10
+
+# تقسیم آیتم‌ها به کمترین تعداد دسته با اندازه‌های نزدیک به هم (آلبوم تک‌عضوی مجاز نیست)
+def split_media_group(items):
+    chunks = -(-len(items) // MEDIA_GROUP_LIMIT)
+    return [items[i * len(items) // chunks:(i + 1) * len(items) // chunks] for i in range(chunks)]
+
+def build_media_group(items, file_ids, caption):
+    media = []
+    for index, media_type, url in items:
+        source = file_ids.get(index) or url
+        # کپشن فقط یک بار روی اولین آیتم آلبوم نمایش داده می‌شود
+        item_caption = caption if not media else None
+        if media_type == "video":
+            media.append(types.InputMediaVideo(source, caption=item_caption))
+        else:
+            media.append(types.InputMediaPhoto(source, caption=item_caption))
+    return media
+
+# ارسال یک دسته از آیتم‌های پست چندتایی با یک درخواست send_media_group
+async def send_media_album(chat_id, key, items, caption):
+    file_ids = {}
+    for index, media_type, _ in items:
+        file_id = db.get_file_id(key, index, media_type)
+        if file_id:
+            file_ids[index] = file_id
+
+    while True:
+        try:
+            with span("send_media_group"):
+                sent = await bot.send_media_group(chat_id, build_media_group(items, file_ids, caption))
+            break
+        except ApiTelegramException as e:
+            if is_url_fetch_error(e):
+                # آیتم‌ها جداگانه ارسال می‌شوند تا در صورت نیاز هر کدام با آپلود جریانی فرستاده شوند
+                for number, (index, media_type, url) in enumerate(items):
+                    await send_media(chat_id, key, index, media_type, url, caption if number == 0 else None)
+                return
+            # یکی از file_id های ذخیره‌شده نامعتبر است؛ دسته با لینک‌ها دوباره ارسال می‌شود
+            if not is_file_id_error(e) or not file_ids:
+                raise
+            for index, media_type, _ in items:
+                if index in file_ids:
+                    db.delete_file_id(key, index, media_type)
+            file_ids = {}
+
+    for (index, media_type, _), message in zip(items, sent):
+        if index not in file_ids:
+            file_id = sent_file_id(message, media_type)
+            if file_id:
+                db.save_file_id(key, index, media_type, file_id)
+
 # تابع دانلود اینستاگرام
-async def download_instagram_content(chat_id, url):
-    params = {"apikey": API_KEY, "type": "post", "url": url}
+async def download_instagram_content(chat_id, link):
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(FASTCREATE_API, params=params) as resp:
-                data = await resp.json()
+        data = await fetch_post_data(link)
 
         if data.get("ok") and data["result"].get("result"):
-            first_item = data["result"]["result"][0]
-            caption = first_item.get("caption", "") + "\n\n This Bot has Open Source"
+            results = data["result"]["result"]
+            caption = (results[0].get("caption") or "") + "\n\n This Bot has Open Source"
+            items = media_items(results)
 
-            if first_item.get("is_video") and first_item.get("video_url"):
-                bot.send_video(chat_id, video=first_item["video_url"], caption=caption)
-            elif first_item.get("display_url"):
-                bot.send_photo(chat_id, photo=first_item["display_url"], caption=caption)
+            if not items:
+                set_status("no_media")
+                await bot.send_message(chat_id, "❌ No downloadable content found for this link.")
+            elif len(items) == 1:
+                index, media_type, url = items[0]
+                await send_media(chat_id, link.key, index, media_type, url, caption)
             else:
-                bot.send_message(chat_id, "❌ No downloadable content found for this link.")
+                # پست چندتایی: ceil(N/10) درخواست به جای N درخواست
+                for number, chunk in enumerate(split_media_group(items)):
+                    await send_media_album(chat_id, link.key, chunk, caption if number == 0 else None)
         else:
-            bot.send_message(chat_id, "⛔️ Error fetching content. Please try again.")
+            set_status("upstream_error")
+            await bot.send_message(chat_id, "⛔️ Error fetching content. Please try again.")
+    except CircuitOpen:
+        # upstream در حال حاضر خراب است؛ بدون انتظار به کاربر اطلاع داده می‌شود
+        set_status("circuit_open")
+        await bot.send_message(chat_id, "🛠 The download server is having problems right now. Please try again in a few minutes.")
+    except asyncio.TimeoutError:
+        ERRORS.inc(("download", "TimeoutError"))
+        set_status("timeout")
+        await bot.send_message(chat_id, "⏳ The download server is not responding. Please try again later.")
+    except MediaTooLarge:
+        ERRORS.inc(("download", "MediaTooLarge"))
+        set_status("too_large")
+        await bot.send_message(chat_id, "📦 This file is larger than the 50 MB Telegram allows bots to upload.")
     except Exception as e:
-        bot.send_message(chat_id, f"❌ Error: {str(e)}")
+        ERRORS.inc(("download", type(e).__name__))
+        set_status(f"error:{type(e).__name__}")
+        # متن خطا (ممکن است شامل جزئیات درخواست باشد) فقط در لاگ ثبت می‌شود
+        print(f"Download error: {e}")
+        await bot.send_message(chat_id, "❌ Something went wrong while downloading this post. Please try again later.")
 
-def run_flask():
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port)
+# نوشتن دوره‌ای تغییرات بافر شده در دیتابیس
+async def flush_writes_periodically():
+    while True:
+        await asyncio.sleep(WRITE_FLUSH_INTERVAL_MS / 1000)
+        try:
+            db.flush()
+        except sqlite3.Error as e:
+            ERRORS.inc(("flush", type(e).__name__))
+            print(f"Database flush error: {e}")
+
+# آپدیت‌های ضبط‌شده در دسته‌های چندثانیه‌ای نوشته می‌شوند تا فشرده‌سازی مؤثر باشد
+async def flush_recording_periodically():
+    while True:
+        await asyncio.sleep(RECORD_UPDATES_FLUSH_INTERVAL)
+        try:
+            update_recorder.flush()
+        except OSError as e:
+            update_recorder.counters['errors'] += 1
+            print(f"Update recording error: {e}")
+
+def create_app():
+    app = web.Application()
+    app.add_routes(routes)
+    app.router.add_post(WEBHOOK_PATH, webhook_receiver.handle)
+    return app
+
+async def run_bot():
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    # HTTP پروسه‌های کارگر فقط برای تجمیع آمار در پروسه ناظر است
+    await web.TCPSite(runner, '127.0.0.1' if IS_WORKER else '0.0.0.0', PORT).start()
+    await download_scheduler.start()
+    flusher = asyncio.create_task(flush_writes_periodically())
+    sweeper = asyncio.create_task(membership_verifier.sweep_forever()) if IS_PRIMARY else None
+    recording = asyncio.create_task(flush_recording_periodically()) if update_recorder else None
+    
+    # ارسال‌های همگانی نیمه‌تمام از آخرین نقطه ذخیره‌شده ادامه پیدا می‌کنند
+    if IS_PRIMARY:
+        for job in db.get_broadcast_jobs("running"):
+            start_broadcast_job(job['job_id'])
+    
+    try:
+        if IS_WORKER:
+            # آپدیت‌ها از پروسه ناظر می‌رسند؛ بسته شدن stdin یعنی خاموش شدن
+            await webhook_receiver.start()
+            await read_worker_updates(webhook_receiver)
+            await webhook_receiver.queue.join()
+        elif BOT_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise RuntimeError("WEBHOOK_URL is required in webhook mode")
+            await webhook_receiver.start()
+            await bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                max_connections=100
+            )
+            print(f"📡 Webhook mode: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+            await asyncio.Event().wait()
+        else:
+            # وبهوک فعال باشد getUpdates کار نمی‌کند
+            await bot.delete_webhook()
+            await bot.infinity_polling()
+    finally:
+        await webhook_receiver.stop()
+        await download_scheduler.stop()
+        # ارسال‌های همگانی در آخرین کاربر تحویل‌شده ذخیره و متوقف می‌شوند
+        if broadcast_states:
+            broadcast_stop_requests.update(broadcast_states)
+            await asyncio.wait(list(broadcast_states.values()), timeout=10)
+        await runner.cleanup()
+        await upstream.close()
+        await bot.close_session()
+        if sweeper:
+            sweeper.cancel()
+        flusher.cancel()
+        if recording:
+            recording.cancel()
+            update_recorder.flush()
+        db.flush()
+        db.close()
+
+async def run_supervisor():
+    supervisor = Supervisor(
+        bot,
+        [sys.executable, os.path.abspath(__file__)],
+        workers=BOT_WORKERS,
+        port_base=BOT_WORKER_PORT_BASE,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+        recorder=update_recorder
+    )
+    app = web.Application()
+    app.router.add_get('/', home)
+    supervisor.add_routes(app)
+    app.router.add_post(WEBHOOK_PATH, supervisor.webhook_handler(WEBHOOK_SECRET))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', PORT).start()
+    supervisor.start()
+    recording = asyncio.create_task(flush_recording_periodically()) if update_recorder else None
+    print(f"🧩 Supervisor started {BOT_WORKERS} workers")
+    
+    try:
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise RuntimeError("WEBHOOK_URL is required in webhook mode")
+            await bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                max_connections=100
+            )
+            print(f"📡 Webhook mode: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+            await asyncio.Event().wait()
+        else:
+            await supervisor.poll()
+    finally:
+        await supervisor.stop()
+        await runner.cleanup()
+        await bot.close_session()
+        if recording:
+            recording.cancel()
+            update_recorder.flush()
+        db.close()
 
 if __name__ == "__main__":
-    # Run Flask in a separate thread
-    flask_thread = Thread(target=run_flask)
-    flask_thread.daemon = True
-    flask_thread.start()
+    if not IS_WORKER:
+        print("🤖 Bot is running with advanced features!")
+        print("📊 Database initialized!")
+        print("🔒 Membership system activated!")
+        print("🚀 Deployed on Railway!")
     
-    print("🤖 Bot is running with advanced features!")
-    print("📊 Database initialized!")
-    print("🔒 Membership system activated!")
-    print("🚀 Deployed on Railway!")
+    if IS_WORKER:
+        # Ctrl+C به همه پروسه‌های گروه می‌رسد؛ کارگر با بسته شدن stdin توسط ناظر خاموش می‌شود
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
     
     try:
-        bot.infinity_polling()
+        if IS_SUPERVISOR:
+            asyncio.run(run_supervisor())
+        else:
+            # همه هندلرها، ارسال‌ها و درخواست‌ها روی یک event loop اجرا می‌شوند
+            asyncio.run(run_bot())
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         print(f"Bot error: {e}")
\ No newline at end of file
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from telebot.asyncio_helper import ApiTelegramException, ApiHTTPException, RequestTimeout
+
+# خطاهایی که نشان می‌دهند کاربر دیگر پیام دریافت نمی‌کند
+BLOCKED_ERRORS = (
+    "bot was blocked by the user",
+    "user is deactivated",
+    "chat not found",
+    "bot can't initiate conversation"
+)
+
+# محدودکننده نرخ (token bucket) مشترک بین همه ارسال‌ها
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        # پاسخ 429 تلگرام: همه ارسال‌ها تا retry_after متوقف می‌شوند
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+# ارسال همگانی همزمان با رعایت محدودیت نرخ تلگرام
+class BroadcastEngine:
+    def __init__(self, db, limiter, concurrency=20, chunk_size=500, max_retries=3, progress_interval=3,
+                 checkpoint_every=100):
+        self.db = db
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self.checkpoint_every = checkpoint_every
+
+    async def _deliver(self, send, user_id, stats):
+        """نتیجه ارسال به یک کاربر: success، blocked یا failed"""
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                await send(user_id)
+                return 'success'
+            except ApiTelegramException as e:
+                if e.error_code == 429:
+                    # محدودیت نرخ جزو تلاش‌های ناموفق حساب نمی‌شود
+                    retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                    self.limiter.pause(retry_after)
+                    stats['throttled'] += 1
+                    continue
+                if e.error_code in (400, 403) and any(text in e.description for text in BLOCKED_ERRORS):
+                    self.db.mark_user_blocked(user_id)
+                    return 'blocked'
+                if e.error_code < 500:
+                    print(f"Failed to send to {user_id}: {e}")
+                    return 'failed'
+            except (ApiHTTPException, RequestTimeout, asyncio.TimeoutError) as e:
+                print(f"Transient error sending to {user_id}: {e}")
+
+            # خطای موقت: تلاش دوباره با تأخیر افزایشی
+            attempt += 1
+            if attempt > self.max_retries:
+                return 'failed'
+            stats['retries'] += 1
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+    async def run(self, send, progress=None, after_user_id=0, on_checkpoint=None, should_stop=None, skip=()):
+        """
+        ارسال به کاربرانی که user_id آن‌ها از after_user_id بزرگ‌تر است.
+        on_checkpoint(user_id, stats, ahead) با آخرین کاربری صدا زده می‌شود که همه کاربران قبل از او
+        پیام را گرفته‌اند؛ ahead کاربران بعد از این نقطه هستند که پیام را گرفته‌اند و در stats شمرده شده‌اند.
+        با ادامه دادن از همین نقطه و skip=ahead هیچ کاربری جا نمی‌ماند و پیام تکراری نمی‌گیرد.
+        """
+        stats = {'success': 0, 'failed': 0, 'blocked': 0, 'retries': 0, 'throttled': 0}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last_progress = time.monotonic()
+        cursor = after_user_id
+        stopped = False
+        skip = set(skip)
+        ahead = set(skip)
+
+        while not stopped:
+            if should_stop and should_stop():
+                stopped = True
+                break
+            user_ids = self.db.get_broadcast_recipients(cursor, self.chunk_size)
+            if not user_ids:
+                break
+
+            delivered = [False] * len(user_ids)
+            watermark = 0
+            # ارسال‌های کامل‌شده از آخرین ذخیره؛ کاربر کند در watermark مانع ذخیره ارسال‌های بعدی نمی‌شود
+            completed = 0
+
+            def checkpoint():
+                last_user_id = user_ids[watermark - 1] if watermark else cursor
+                on_checkpoint(last_user_id, stats, sorted(user_id for user_id in ahead if user_id > last_user_id))
+
+            def advance():
+                nonlocal watermark, completed
+                while watermark < len(user_ids) and delivered[watermark]:
+                    ahead.discard(user_ids[watermark])
+                    watermark += 1
+                completed += 1
+                if on_checkpoint and completed >= self.checkpoint_every:
+                    completed = 0
+                    checkpoint()
+
+            async def deliver(index, user_id):
+                # قبل از توقف قبلی ارسال و شمرده شده است
+                if user_id not in skip:
+                    async with semaphore:
+                        if should_stop and should_stop():
+                            return
+                        outcome = await self._deliver(send, user_id, stats)
+                    stats[outcome] += 1
+                    ahead.add(user_id)
+                delivered[index] = True
+                advance()
+
+            tasks = [asyncio.create_task(deliver(i, user_id)) for i, user_id in enumerate(user_ids)]
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=self.progress_interval)
+                if progress and time.monotonic() - last_progress >= self.progress_interval:
+                    last_progress = time.monotonic()
+                    await progress(stats)
+
+            stopped = watermark < len(user_ids)
+            if watermark:
+                cursor = user_ids[watermark - 1]
+            # در توقف، ارسال‌های بعد از watermark هم ذخیره می‌شوند حتی اگر watermark جلو نرفته باشد
+            if on_checkpoint and (completed or stopped):
+                checkpoint()
+            # خطای پیش‌بینی‌نشده در ارسال بعد از ذخیره پیشرفت به فراخواننده می‌رسد
+            for task in tasks:
+                if task.exception():
+                    raise task.exception()
+
+        return stats, stopped
@@ -0,0 +1,90 @@
+import json
+import re
+import time
+from collections import OrderedDict
+
+# پارامتر oe در لینک‌های CDN اینستاگرام زمان انقضای لینک است (timestamp به صورت hex)
+CDN_EXPIRY_PATTERN = re.compile(r'[?&]oe=([0-9A-Fa-f]{8})')
+
+# کش پاسخ API دانلود بر اساس shortcode پست
+# لایه اول: LRU در حافظه، لایه دوم: جدول upstream_cache در SQLite
+class PostCache:
+    def __init__(self, db, max_items=1000, default_ttl=3600, max_ttl=86400, expiry_margin=300):
+        self.db = db
+        self.max_items = max_items
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.expiry_margin = expiry_margin
+        self._items = OrderedDict()
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'stores': 0
+        }
+
+    def expires_at(self, serialized, now):
+        # لینک‌ها نباید بعد از منقضی شدن در CDN از کش برگردانده شوند
+        expiry = now + self.max_ttl
+        found = False
+        for value in CDN_EXPIRY_PATTERN.findall(serialized):
+            expiry = min(expiry, int(value, 16) - self.expiry_margin)
+            found = True
+        if not found:
+            expiry = now + self.default_ttl
+        return expiry
+
+    def _remember(self, shortcode, payload, expires_at):
+        self._items[shortcode] = (payload, expires_at)
+        self._items.move_to_end(shortcode)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def get(self, shortcode):
+        now = time.time()
+        entry = self._items.get(shortcode)
+        if entry is not None:
+            payload, expires_at = entry
+            if expires_at > now:
+                self._items.move_to_end(shortcode)
+                self.counters['memory_hits'] += 1
+                return payload
+            del self._items[shortcode]
+            self.counters['expired'] += 1
+
+        row = self.db.get_cached_post(shortcode)
+        if row is not None:
+            if row['expires_at'] > now:
+                payload = json.loads(row['payload'])
+                self._remember(shortcode, payload, row['expires_at'])
+                self.counters['disk_hits'] += 1
+                return payload
+            self.db.delete_cached_post(shortcode)
+            self.counters['expired'] += 1
+
+        self.counters['misses'] += 1
+        return None
+
+    def set(self, shortcode, payload):
+        now = time.time()
+        serialized = json.dumps(payload, ensure_ascii=False)
+        expires_at = self.expires_at(serialized, now)
+        if expires_at <= now:
+            return
+        self._remember(shortcode, payload, expires_at)
+        self.db.save_cached_post(shortcode, serialized, expires_at)
+        self.counters['stores'] += 1
+
+    def invalidate(self, shortcode):
+        self._items.pop(shortcode, None)
+        self.db.delete_cached_post(shortcode)
+
+    def stats(self):
+        lookups = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['misses']
+        hits = self.counters['memory_hits'] + self.counters['disk_hits']
+        return dict(
+            self.counters,
+            memory_items=len(self._items),
+            hit_ratio=round(hits / lookups, 4) if lookups else 0.0
+        )
@@ -0,0 +1,52 @@
+import re
+from collections import namedtuple
+
+# همه شکل‌های رایج لینک اینستاگرام در یک الگوی از پیش کامپایل‌شده:
+# instagr.am، دامنه موبایل، نام کاربری قبل از p/reel، لینک‌های اشتراک با igsh و لینک داخل متن
+# دامنه باید بعد از scheme، ابتدای متن یا فاصله بیاید تا evil.com/instagram.com/... پذیرفته نشود؛
+# share/reel/<token> لینک کوتاه اشتراک است و share نام کاربری نیست
+INSTAGRAM_URL_PATTERN = re.compile(
+    r'(?:(?<![\w./=?&%:-])https?://|(?<!\S))(?:(?:www|m)\.)?(?:instagram\.com|instagr\.am)/'
+    r'(?:'
+    r'(?:(?!share/)[\w.]{1,30}/)?(?P<kind>p|reels?|tv)/(?P<shortcode>(?!audio/)[\w-]{5,})'
+    r'|stories/(?P<username>[\w.]{1,30})/(?P<story_id>\d+)'
+    r')',
+    re.IGNORECASE | re.ASCII
+)
+
+# پست، ریل و IGTV با یک shortcode به یک رسانه اشاره می‌کنند
+MEDIA_KINDS = ('p', 'reel', 'tv')
+
+class InstagramLink(namedtuple('InstagramLink', 'kind shortcode url')):
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """کلید کش و ادغام درخواست‌ها برای این لینک"""
+        if self.kind in MEDIA_KINDS:
+            return self.shortcode
+        return f"{self.kind}:{self.shortcode}"
+
+def parse_instagram_url(text):
+    """اولین لینک پشتیبانی‌شده اینستاگرام در متن را به شکل استاندارد برمی‌گرداند، در غیر این صورت None"""
+    # بیشتر پیام‌ها اصلاً لینک اینستاگرام ندارند و بدون اجرای regex رد می‌شوند
+    if not text or 'instagr' not in text.lower():
+        return None
+    match = INSTAGRAM_URL_PATTERN.search(text)
+    if not match:
+        return None
+
+    kind = match.group('kind')
+    if kind:
+        kind = kind.lower()
+        if kind == 'reels':
+            kind = 'reel'
+        shortcode = match.group('shortcode')
+        return InstagramLink(kind, shortcode, f"https://www.instagram.com/{kind}/{shortcode}/")
+
+    username = match.group('username')
+    story_id = match.group('story_id')
+    return InstagramLink('stories', story_id, f"https://www.instagram.com/stories/{username}/{story_id}/")
+
+def is_instagram_url(text):
+    return parse_instagram_url(text) is not None
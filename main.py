@@ -8,6 +8,7 @@ from contextlib import contextmanager
 from flask import Flask
 from threading import Thread
 import asyncio
+from links import parse_instagram_url
 
 # Flask app for Railway
 app = Flask(__name__)
@@ -727,15 +728,6 @@ Select an option below:
 def handle_message(message):
     user_id = message.from_user.id
     
-    if not check_membership(user_id):
-        lang = user_lang.get(user_id, "fa")
-        bot.reply_to(
-            message,
-            membership_required_message(lang),
-            reply_markup=create_membership_keyboard()
-        )
-        return
-
     # هندلر ارسال همگانی
     if user_id == ADMIN_ID and user_id in user_states and user_states[user_id].startswith("broadcast_"):
         broadcast_type = user_states[user_id].replace("broadcast_", "")
@@ -764,19 +756,28 @@ def handle_message(message):
         bot.reply_to(message, f"✅ Broadcast completed!\nSuccess: {success}\nFailed: {failed}")
         return
 
-    url = message.text.strip() if message.text else None
-
-    if not url or not url.startswith("http") or "instagram.com" not in url:
+    # لینک‌های پشتیبانی‌نشده قبل از هر درخواست شبکه رد می‌شوند
+    link = parse_instagram_url(message.text)
+    if not link:
         bot.reply_to(message, "❌ Please send a valid Instagram link.")
         return
 
+    if not check_membership(user_id):
+        lang = user_lang.get(user_id, "fa")
+        bot.reply_to(
+            message,
+            membership_required_message(lang),
+            reply_markup=create_membership_keyboard()
+        )
+        return
+
     bot.reply_to(message, "⏳ Downloading content, please wait...")
     db.increment_download_count(user_id)
 
     # استفاده از asyncio برای اجرای تابع دانلود
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    loop.run_until_complete(download_instagram_content(message.chat.id, url))
+    loop.run_until_complete(download_instagram_content(message.chat.id, link.url))
     loop.close()
 
 # تابع دانلود اینستاگرام
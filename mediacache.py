@@ -0,0 +1,175 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+def _writer_alive(pid):
+    try:
+        pid = int(pid)
+    except ValueError:
+        return False
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# کش دیسکی فایل‌هایی که ربات خودش دانلود و آپلود کرده است
+# نام فایل‌ها hash محتوای آن‌هاست و فهرست در حافظه (و جدول media_files) نگه داشته می‌شود
+# تا برای پیدا کردن فایل نیازی به stat کردن پوشه نباشد
+# با owner (هر پروسه کارگر) کلیدهای جدول media_files پیشوند owner| می‌گیرند تا هر پروسه فقط
+# فایل‌ها و ردیف‌های پوشه خودش را بارگذاری و حذف کند
+class MediaCache:
+    def __init__(self, db, path, max_bytes=1024 * 1024 * 1024, owner=""):
+        self.db = db
+        self.path = path
+        self.max_bytes = max_bytes
+        self.prefix = f"{owner}|" if owner else ""
+        self._keys = OrderedDict()
+        self._sizes = {}
+        self._refs = {}
+        self._bytes = 0
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'missing': 0
+        }
+        self._load()
+
+    def _file_path(self, digest):
+        return os.path.join(self.path, digest)
+
+    def _load(self):
+        os.makedirs(self.path, exist_ok=True)
+        # فایل‌های موقت نوشتن‌های نیمه‌تمام قبل از ری‌استارت
+        # (فایل‌های موقت پروسه‌های کارگر دیگر که هنوز در حال نوشتن هستند حذف نمی‌شوند)
+        for name in os.listdir(self.path):
+            if name.endswith(".tmp") and not _writer_alive(name.split("-", 1)[0]):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+
+        for row in self.db.get_media_files(self.prefix):
+            if row['digest'] not in self._sizes and not os.path.exists(self._file_path(row['digest'])):
+                self.db.delete_media_file(row['media_key'])
+                continue
+            self._add(row['media_key'][len(self.prefix):], row['digest'], row['size'])
+        self._evict()
+
+    def _add(self, media_key, digest, size):
+        if self._keys.get(media_key) == digest:
+            self._keys.move_to_end(media_key)
+            return
+        if media_key in self._keys:
+            self._remove(media_key)
+        self._keys[media_key] = digest
+        if digest not in self._sizes:
+            self._sizes[digest] = size
+            self._bytes += size
+        self._refs[digest] = self._refs.get(digest, 0) + 1
+
+    def _remove(self, media_key):
+        digest = self._keys.pop(media_key)
+        self._refs[digest] -= 1
+        if self._refs[digest]:
+            return
+        # فایل فقط وقتی حذف می‌شود که کلید دیگری به همین محتوا اشاره نکند
+        del self._refs[digest]
+        self._bytes -= self._sizes.pop(digest)
+        try:
+            os.remove(self._file_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._keys:
+            media_key = next(iter(self._keys))
+            self._remove(media_key)
+            self.db.delete_media_file(self.prefix + media_key)
+            self.counters['evictions'] += 1
+
+    def contains(self, media_key):
+        return media_key in self._keys
+
+    def get(self, media_key):
+        """مسیر فایل ذخیره‌شده برای این رسانه یا None"""
+        digest = self._keys.get(media_key)
+        if digest is None:
+            self.counters['misses'] += 1
+            return None
+        self._keys.move_to_end(media_key)
+        self.db.touch_media_file(self.prefix + media_key, time.time())
+        self.counters['hits'] += 1
+        return self._file_path(digest)
+
+    def invalidate(self, media_key):
+        # فایل خارج از ربات حذف شده است
+        if media_key in self._keys:
+            self._remove(media_key)
+            self.db.delete_media_file(self.prefix + media_key)
+            self.counters['missing'] += 1
+
+    def writer(self, media_key):
+        return MediaCacheWriter(self, media_key)
+
+    def _store(self, media_key, temp_path, digest, size):
+        final_path = self._file_path(digest)
+        if digest in self._sizes:
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, final_path)
+        self._add(media_key, digest, size)
+        self.db.save_media_file(self.prefix + media_key, digest, size, time.time())
+        self.counters['stores'] += 1
+        self._evict()
+
+    def stats(self):
+        return dict(
+            self.counters,
+            keys=len(self._keys),
+            files=len(self._sizes),
+            bytes=self._bytes,
+            max_bytes=self.max_bytes
+        )
+
+# نوشتن تکه‌به‌تکه در یک فایل موقت؛ فایل فقط بعد از commit با rename در کش قرار می‌گیرد
+class MediaCacheWriter:
+    def __init__(self, cache, media_key):
+        self.cache = cache
+        self.media_key = media_key
+        self.temp_path = os.path.join(cache.path, f"{os.getpid()}-{id(self)}.tmp")
+        self._file = open(self.temp_path, "wb")
+        self._hash = hashlib.sha256()
+        self._size = 0
+
+    def write(self, chunk):
+        if self._file is None:
+            return
+        self._size += len(chunk)
+        if self._size > self.cache.max_bytes:
+            # فایلی که از کل بودجه کش بزرگ‌تر است ذخیره نمی‌شود
+            self.discard()
+            return
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self.cache._store(self.media_key, self.temp_path, self._hash.hexdigest(), self._size)
+
+    def discard(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self.temp_path)
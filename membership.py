@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+# بررسی زنده عضویت در کانال‌ها با get_chat_member
+# درخواست‌ها برای همه کانال‌ها همزمان ارسال و نتایج برای مدتی کش می‌شوند
+class MembershipVerifier:
+    def __init__(self, bot, db, ttl=21600, negative_ttl=5, cache_size=100000,
+                 sweep_interval=60, sweep_batch=20, sweep_rate=10, error_retry=600, error_grace=21600):
+        self.bot = bot
+        self.db = db
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache_size = cache_size
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.sweep_rate = sweep_rate
+        self.error_retry = error_retry
+        self.error_grace = error_grace
+        self._cache = {}
+        self.counters = {
+            'cache_hits': 0,
+            'api_checks': 0,
+            'api_errors': 0,
+            'swept': 0,
+            'revoked': 0,
+            'expired': 0
+        }
+
+    async def _is_member(self, user_id, channel_id):
+        self.counters['api_checks'] += 1
+        try:
+            chat_member = await self.bot.get_chat_member(channel_id, user_id)
+        except Exception as e:
+            self.counters['api_errors'] += 1
+            print(f"Error checking membership: {e}")
+            return None
+        return chat_member.status in MEMBER_STATUSES
+
+    def _remember(self, user_id, channel_id, is_member, now):
+        if len(self._cache) >= self.cache_size:
+            self._cache = {}
+        ttl = self.ttl if is_member else self.negative_ttl
+        self._cache[(user_id, channel_id)] = (is_member, now + ttl)
+
+    async def verify(self, user_id, channels):
+        """عضویت کاربر در همه کانال‌ها را بررسی و نتیجه را در دیتابیس ثبت می‌کند"""
+        now = time.time()
+        results = {}
+        to_check = []
+        for channel in channels:
+            channel_id = channel['channel_id']
+            cached = self._cache.get((user_id, channel_id))
+            if cached and cached[1] > now:
+                self.counters['cache_hits'] += 1
+                results[channel_id] = cached[0]
+            else:
+                to_check.append(channel_id)
+
+        checked = await asyncio.gather(*(self._is_member(user_id, channel_id) for channel_id in to_check))
+        for channel_id, is_member in zip(to_check, checked):
+            results[channel_id] = bool(is_member)
+            if is_member is None:
+                continue
+            self._remember(user_id, channel_id, is_member, now)
+            if is_member:
+                self.db.verify_membership(user_id, channel_id)
+            else:
+                self.db.revoke_membership(user_id, channel_id)
+
+        return all(results.values())
+
+    async def _recheck(self, user_id, channel_id, verified_at):
+        is_member = await self._is_member(user_id, channel_id)
+        self.counters['swept'] += 1
+        now = time.time()
+        if is_member is None and (verified_at or 0) >= now - self.ttl - self.error_grace:
+            # خطای API: تأیید قبلی تمدید نمی‌شود و بعد از error_retry دوباره بررسی می‌شود
+            self.db.mark_membership_checked(user_id, channel_id)
+        elif is_member is None or not is_member:
+            # کانالی که مدت طولانی قابل بررسی نیست عضویت را بی‌نهایت معتبر نگه نمی‌دارد؛
+            # کاربر در استفاده بعدی دوباره به صورت زنده بررسی می‌شود
+            self.counters['revoked' if is_member is False else 'expired'] += 1
+            self._cache.pop((user_id, channel_id), None)
+            self.db.revoke_membership(user_id, channel_id)
+        else:
+            self._remember(user_id, channel_id, True, now)
+            self.db.verify_membership(user_id, channel_id)
+
+    async def sweep_once(self):
+        now = time.time()
+        stale = self.db.get_stale_memberships(now - self.ttl, self.sweep_batch, now - self.error_retry)
+        if stale:
+            await asyncio.gather(*(
+                self._recheck(row['user_id'], row['channel_id'], row['verified_at']) for row in stale
+            ))
+        return len(stale)
+
+    async def sweep_forever(self):
+        # بررسی مجدد عضویت‌های قدیمی در دسته‌های کوچک با رعایت محدودیت نرخ درخواست
+        while True:
+            try:
+                checked = await self.sweep_once()
+            except Exception as e:
+                print(f"Membership sweep error: {e}")
+                checked = 0
+            if checked:
+                await asyncio.sleep(checked / self.sweep_rate)
+            else:
+                await asyncio.sleep(self.sweep_interval)
+
+    def stats(self):
+        return dict(self.counters, cached=len(self._cache))
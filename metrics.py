@@ -0,0 +1,128 @@
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# متریک‌ها در قالب متنی Prometheus
+# ثبت یک مقدار فقط یک جستجو در dict و یک جمع است؛ کار سنگین‌تر هنگام خواندن /metrics انجام می‌شود
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        values = self._values
+        values[labels] = values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in list(self._values.items()):
+            yield self.name + _format_labels(self.labelnames, labels), value
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # برای هر سری: تعداد در هر بازه (غیر تجمعی) و در انتها مجموع مقادیر
+        self._series = {}
+
+    def observe(self, value, labels=()):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                yield self.name + "_bucket" + _format_labels(self.labelnames, labels, le), cumulative
+            yield self.name + "_sum" + _format_labels(self.labelnames, labels), series[-1]
+            yield self.name + "_count" + _format_labels(self.labelnames, labels), cumulative
+
+# مقدار متریک هنگام خواندن /metrics از آمار فعلی اجزا (صف‌ها، کش‌ها و ...) خوانده می‌شود
+class Callback:
+    def __init__(self, name, help, type, labelnames, func):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labelnames = labelnames
+        self.func = func
+
+    def samples(self):
+        for labels, value in self.func().items():
+            yield self.name + _format_labels(self.labelnames, labels), value
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, type, labelnames, func):
+        return self._add(Callback(name, help, type, labelnames, func))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for sample, value in metric.samples():
+                lines.append(f"{sample} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def timed_methods(histogram, exclude=()):
+    """زمان اجرای همه متدهای عمومی کلاس را با نام متد به عنوان label ثبت می‌کند"""
+    def decorate(cls):
+        for name, func in list(vars(cls).items()):
+            if name.startswith("_") or name in exclude or not callable(func):
+                continue
+            setattr(cls, name, _timed(func, histogram, (name,)))
+        return cls
+    return decorate
+
+def _timed(func, histogram, labels):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started, labels)
+    return wrapper
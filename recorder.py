@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+import zlib
+
+from links import INSTAGRAM_URL_PATTERN
+
+# شناسه‌ای که مدیر ربات در فایل ضبط‌شده با آن جایگزین می‌شود تا در بازپخش هم مدیر باشد
+ADMIN_PSEUDONYM = 1
+
+# اطلاعات شخصی که در فایل ضبط‌شده نگه داشته نمی‌شوند
+DROPPED_FIELDS = {
+    'last_name', 'username', 'phone_number', 'bio', 'description', 'invite_link',
+    'active_usernames', 'emoji_status_custom_emoji_id', 'contact', 'location', 'venue'
+}
+NAME_FIELDS = {'first_name': 'user', 'title': 'chat'}
+# متن و فهرست موجودیت‌های (entities) مربوط به آن
+TEXT_FIELDS = {'text': 'entities', 'caption': 'caption_entities'}
+# شناسه‌هایی که داخل شیء User یا Chat نیستند (مثلاً chat_join_request.user_chat_id)
+ID_SUFFIXES = ('user_id', 'chat_id')
+ID_LIST_SUFFIXES = ('user_ids', 'chat_ids')
+
+def scrub_text(text):
+    """فقط لینک‌های اینستاگرام و نام دستورها باقی می‌مانند؛ بقیه متن با طول مشابه جایگزین می‌شود"""
+    links = [match.group(0) for match in INSTAGRAM_URL_PATTERN.finditer(text)]
+    if links:
+        return " ".join(links)
+    if text.startswith("/"):
+        return text.split(maxsplit=1)[0]
+    return "x" * len(text)
+
+def text_entities(text):
+    """موجودیت‌های متن پاک‌شده (دستور ابتدای متن و لینک‌ها) با offset های متن جدید"""
+    entities = []
+    if text.startswith("/"):
+        entities.append({"offset": 0, "length": len(text.split(maxsplit=1)[0]), "type": "bot_command"})
+    for match in INSTAGRAM_URL_PATTERN.finditer(text):
+        entities.append({"offset": match.start(), "length": len(match.group(0)), "type": "url"})
+    return entities
+
+# ضبط آپدیت‌های ورودی (ناشناس‌شده) برای بازپخش در بنچمارک
+# هر خط یک رکورد JSON است و هر دسته از خط‌ها یک عضو gzip جداگانه به انتهای فایل اضافه می‌کند،
+# پس فایل فقط append می‌شود و با قطع ناگهانی فقط آخرین دسته ناقص از دست می‌رود
+class UpdateRecorder:
+    def __init__(self, path, admin_ids=(), salt=None, batch_size=1000):
+        self.path = path
+        self.admin_ids = set(admin_ids)
+        # بدون salt ثابت، شناسه‌های ناشناس در هر اجرا متفاوت هستند
+        self.salt = salt.encode() if salt else secrets.token_bytes(16)
+        self.batch_size = batch_size
+        self._buffer = []
+        self.counters = {
+            'recorded': 0,
+            'flushes': 0,
+            'bytes': 0,
+            'errors': 0
+        }
+
+    def pseudonym(self, value):
+        if value in self.admin_ids:
+            return ADMIN_PSEUDONYM
+        digest = hmac.new(self.salt, str(value).encode(), hashlib.sha256).digest()
+        pseudonym = 1000000000 + int.from_bytes(digest[:4], "big")
+        # گروه‌ها و کانال‌ها شناسه منفی دارند
+        return -pseudonym if value < 0 else pseudonym
+
+    def anonymise(self, value):
+        if isinstance(value, list):
+            return [self.anonymise(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        # User (is_bot) و Chat (type) شناسه عددی دارند
+        is_entity = isinstance(value.get('id'), int) and ('is_bot' in value or 'type' in value)
+        result = {}
+        for key, item in value.items():
+            if key in DROPPED_FIELDS:
+                continue
+            if key == 'id' and is_entity:
+                result[key] = self.pseudonym(item)
+            elif key.endswith(ID_SUFFIXES) and isinstance(item, int) and not isinstance(item, bool):
+                result[key] = self.pseudonym(item)
+            elif key.endswith(ID_LIST_SUFFIXES) and isinstance(item, list):
+                result[key] = [self.pseudonym(i) if isinstance(i, int) else self.anonymise(i) for i in item]
+            elif key in NAME_FIELDS and is_entity:
+                result[key] = NAME_FIELDS[key]
+            elif key in TEXT_FIELDS and isinstance(item, str):
+                result[key] = scrub_text(item)
+            else:
+                result[key] = self.anonymise(item)
+        # offset های موجودیت‌ها فقط با متن اصلی می‌خوانند؛ برای متن پاک‌شده دوباره ساخته می‌شوند
+        for text_key, entities_key in TEXT_FIELDS.items():
+            if text_key in result and result[text_key] != value[text_key]:
+                entities = text_entities(result[text_key])
+                if entities:
+                    result[entities_key] = entities
+                else:
+                    result.pop(entities_key, None)
+        return result
+
+    def record(self, updates):
+        """آپدیت‌های خام (dict) را قبل از تبدیل به شیء telebot ثبت می‌کند"""
+        now = round(time.time(), 3)
+        for update in updates:
+            try:
+                self._buffer.append(json.dumps({"t": now, "u": self.anonymise(update)},
+                                               ensure_ascii=False, separators=(",", ":")))
+                self.counters['recorded'] += 1
+            except (TypeError, ValueError) as e:
+                self.counters['errors'] += 1
+                print(f"Update record error: {e}")
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        data = gzip.compress(("\n".join(self._buffer) + "\n").encode())
+        self._buffer = []
+        with open(self.path, "ab") as f:
+            f.write(data)
+        self.counters['flushes'] += 1
+        self.counters['bytes'] += len(data)
+
+    def stats(self):
+        return dict(self.counters, buffered=len(self._buffer), path=self.path)
+
+def read_updates(path):
+    """رکوردهای (زمان، آپدیت) یک فایل ضبط‌شده؛ دسته ناقص انتهای فایل نادیده گرفته می‌شود"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        data = f.read()
+    while data:
+        # هر عضو gzip جداگانه باز می‌شود تا عضو نیمه‌نوشته‌شده هیچ خطی تولید نکند
+        member = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        try:
+            lines = member.decompress(data)
+        except zlib.error:
+            return
+        if not member.eof:
+            return
+        for line in lines.decode("utf-8").splitlines():
+            record = json.loads(line)
+            yield record["t"], record["u"]
+        data = member.unused_data
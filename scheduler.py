@@ -0,0 +1,127 @@
+import asyncio
+from collections import deque
+
+class QueueFull(Exception):
+    pass
+
+class UserQueueFull(QueueFull):
+    pass
+
+# زمان‌بند دانلودها: صف محدود، تعداد worker ثابت و نوبت‌دهی چرخشی بین کاربران
+class DownloadScheduler:
+    def __init__(self, workers=32, max_queue=500, max_running_per_user=2, max_queued_per_user=10):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_running_per_user = max_running_per_user
+        self.max_queued_per_user = max_queued_per_user
+        self._queues = {}
+        self._turns = deque()
+        self._running = {}
+        self._pending = 0
+        self._running_total = 0
+        self._cond = None
+        self._tasks = []
+        self.counters = {
+            'submitted': 0,
+            'queued': 0,
+            'shed': 0,
+            'completed': 0,
+            'failed': 0
+        }
+
+    def _position(self, user_id):
+        # تخمین تعداد کارهایی که قبل از این کار شروع می‌شوند
+        own = len(self._queues.get(user_id, ()))
+        ahead = own
+        for other, jobs in self._queues.items():
+            if other != user_id:
+                ahead += min(len(jobs), own + 1)
+        free = self.workers - self._running_total
+        if ahead < free and self._running.get(user_id, 0) + own < self.max_running_per_user:
+            return 0
+        return max(ahead - free, 0) + 1
+
+    async def submit(self, user_id, job):
+        """کار را در صف قرار می‌دهد و جایگاه تخمینی آن را برمی‌گرداند (0 یعنی بلافاصله اجرا می‌شود)"""
+        if self._pending >= self.max_queue:
+            self.counters['shed'] += 1
+            raise QueueFull()
+        if len(self._queues.get(user_id, ())) >= self.max_queued_per_user:
+            self.counters['shed'] += 1
+            raise UserQueueFull()
+
+        position = self._position(user_id)
+        async with self._cond:
+            if user_id not in self._queues:
+                self._queues[user_id] = deque()
+                self._turns.append(user_id)
+            self._queues[user_id].append(job)
+            self._pending += 1
+            self._cond.notify()
+
+        self.counters['submitted'] += 1
+        if position:
+            self.counters['queued'] += 1
+        return position
+
+    def _pick(self):
+        for _ in range(len(self._turns)):
+            user_id = self._turns.popleft()
+            if self._running.get(user_id, 0) >= self.max_running_per_user:
+                self._turns.append(user_id)
+                continue
+            jobs = self._queues[user_id]
+            job = jobs.popleft()
+            if jobs:
+                self._turns.append(user_id)
+            else:
+                del self._queues[user_id]
+            self._pending -= 1
+            self._running[user_id] = self._running.get(user_id, 0) + 1
+            self._running_total += 1
+            return user_id, job
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self._cond:
+                picked = self._pick()
+                while picked is None:
+                    await self._cond.wait()
+                    picked = self._pick()
+
+            user_id, job = picked
+            try:
+                await job()
+                self.counters['completed'] += 1
+            except Exception as e:
+                self.counters['failed'] += 1
+                print(f"Download job error: {e}")
+            finally:
+                async with self._cond:
+                    self._running_total -= 1
+                    self._running[user_id] -= 1
+                    if not self._running[user_id]:
+                        del self._running[user_id]
+                    # کاری از همین کاربر ممکن است به خاطر سقف اجرای همزمان منتظر مانده باشد
+                    self._cond.notify_all()
+
+    async def start(self):
+        self._cond = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        return dict(
+            self.counters,
+            pending=self._pending,
+            running=self._running_total,
+            users_waiting=len(self._queues),
+            workers=len(self._tasks),
+            max_queue=self.max_queue
+        )
@@ -0,0 +1,349 @@
+import asyncio
+import hmac
+import json
+import os
+import sys
+import time
+import zlib
+
+import aiohttp
+from aiohttp import web
+from telebot import asyncio_helper
+
+from metrics import Registry
+
+# مسیرهای آماری پروسه‌های کارگر که در پروسه ناظر تجمیع می‌شوند
+STATS_PATHS = ('/upstream', '/cache', '/queue', '/membership', '/uploads', '/media-cache', '/traces', '/ingest')
+
+def shard_for(chat_id, workers):
+    """پروسه‌ای که آپدیت‌های این چت را پردازش می‌کند؛ همه آپدیت‌های یک چت به یک پروسه می‌روند"""
+    if workers <= 1:
+        return 0
+    return zlib.crc32(str(chat_id).encode()) % workers
+
+def update_chat_id(update):
+    # message، callback_query (پیام ربات در همان چت)، chat_member و ... ؛ در غیر این صورت فرستنده
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = value.get('from') or value.get('user')
+        if user:
+            return user['id']
+    return 0
+
+def merge_stats(results):
+    """شمارنده‌ها جمع، فهرست‌ها پشت هم و مقادیر دیگر فقط در صورت برابر بودن در همه پروسه‌ها نگه داشته می‌شوند"""
+    merged = {}
+    dropped = set()
+    for result in results:
+        for key, value in result.items():
+            if key in dropped:
+                continue
+            if key not in merged:
+                merged[key] = value
+            elif isinstance(value, int) and not isinstance(value, bool) and isinstance(merged[key], int):
+                merged[key] += value
+            elif isinstance(value, list) and isinstance(merged[key], list):
+                merged[key] = merged[key] + value
+            elif isinstance(value, dict) and isinstance(merged[key], dict):
+                merged[key] = merge_stats([merged[key], value])
+            elif merged[key] != value:
+                # مثلاً نسبت‌ها که جمع‌پذیر نیستند
+                del merged[key]
+                dropped.add(key)
+    return merged
+
+def slowest_traces(results, limit):
+    """trace های کند همه کارگرها دوباره از کندترین مرتب و به limit درخواست‌شده بریده می‌شوند"""
+    try:
+        limit = max(int(limit), 1)
+    except ValueError:
+        limit = 20
+    traces = [dict(trace, worker=index) for index, result in results for trace in result.get('traces', [])]
+    traces.sort(key=lambda trace: trace['duration_ms'] or 0, reverse=True)
+    return traces[:limit]
+
+def _with_label(sample, label):
+    series, value = sample.rsplit(" ", 1)
+    if "{" in series:
+        series = series.replace("{", "{" + label + ",", 1)
+    else:
+        series = series + "{" + label + "}"
+    return f"{series} {value}"
+
+def merge_metrics(texts):
+    """متن /metrics همه پروسه‌ها با label worker؛ نمونه‌های هر متریک کنار هم می‌مانند"""
+    families = {}
+    for index, text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                name = line.split(" ", 3)[2]
+                family = families.setdefault(name, {'meta': [], 'samples': []})
+                if line not in family['meta']:
+                    family['meta'].append(line)
+            elif line and family is not None:
+                family['samples'].append(_with_label(line, f'worker="{index}"'))
+    lines = []
+    for family in families.values():
+        lines.extend(family['meta'])
+        lines.extend(family['samples'])
+    return "\n".join(lines) + "\n" if lines else ""
+
+# یک پروسه کارگر (python bot.py در حالت worker)؛ آپدیت‌ها به ترتیب دریافت، خط‌به‌خط در stdin آن نوشته می‌شوند
+# تحویل حداکثر یک‌باره است: آپدیت‌های صف ناظر بعد از ری‌استارت به پروسه جدید می‌رسند، اما آپدیت‌هایی که
+# در pipe یا صف داخلی پروسه از کار افتاده بودند از دست می‌روند (تعداد آن‌ها در پروسه ناظر معلوم نیست؛
+# restarts و لاگ کارگر نشانه آن است)
+class WorkerProcess:
+    def __init__(self, index, command, env, port, queue_size=1000):
+        self.index = index
+        self.command = command
+        self.env = env
+        self.port = port
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.process = None
+        self.started_at = None
+        self._alive = asyncio.Event()
+        self._down = asyncio.Event()
+        self._down.set()
+        self._stopping = False
+        self._tasks = []
+        self.counters = {
+            'forwarded': 0,
+            'dropped': 0,
+            'restarts': 0
+        }
+
+    async def _run(self):
+        backoff = 1
+        while True:
+            self.process = await asyncio.create_subprocess_exec(*self.command, env=self.env, stdin=asyncio.subprocess.PIPE)
+            self.started_at = time.monotonic()
+            self._down.clear()
+            self._alive.set()
+            code = await self.process.wait()
+            self._alive.clear()
+            self._down.set()
+            if self._stopping:
+                return
+            self.counters['restarts'] += 1
+            # پروسه‌ای که مدتی سالم کار کرده بلافاصله ری‌استارت می‌شود
+            if time.monotonic() - self.started_at > 60:
+                backoff = 1
+            print(f"Worker {self.index} exited with code {code}, restarting in {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    async def _forward(self):
+        line = None
+        while True:
+            if line is None:
+                line = await self.queue.get()
+            await self._alive.wait()
+            process = self.process
+            try:
+                process.stdin.write(line)
+                await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # همین آپدیت بعد از ری‌استارت به پروسه جدید داده می‌شود
+                while self.process is process or not self._alive.is_set():
+                    await asyncio.sleep(0.1)
+                continue
+            self.counters['forwarded'] += 1
+            line = None
+
+    async def put(self, update, wait=True):
+        """با wait فقط تا وقتی پروسه در حال اجراست برای جای خالی صف صبر می‌کند؛ آپدیت کنار گذاشته شده False برمی‌گرداند"""
+        line = json.dumps(update, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+        if wait and self._alive.is_set():
+            put = asyncio.ensure_future(self.queue.put(line))
+            down = asyncio.ensure_future(self._down.wait())
+            await asyncio.wait((put, down), return_when=asyncio.FIRST_COMPLETED)
+            down.cancel()
+            if put.done():
+                return True
+            # پروسه از کار افتاده است؛ انتظار برای ری‌استارت بقیه کارگرها را هم متوقف می‌کرد
+            put.cancel()
+        try:
+            self.queue.put_nowait(line)
+            return True
+        except asyncio.QueueFull:
+            self.counters['dropped'] += 1
+            return False
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._forward())]
+
+    async def stop(self, timeout=15):
+        self._stopping = True
+        self._tasks[1].cancel()
+        process = self.process
+        if process and process.returncode is None:
+            # با بسته شدن stdin، کارگر کارهای جاری را تمام می‌کند و خارج می‌شود
+            process.stdin.close()
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        self._tasks[0].cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        process = self.process
+        up = self._alive.is_set() and process is not None and process.returncode is None
+        return dict(
+            self.counters,
+            index=self.index,
+            pid=process.pid if process else None,
+            up=up,
+            port=self.port,
+            uptime=round(time.monotonic() - self.started_at, 1) if up else 0,
+            queue_depth=self.queue.qsize()
+        )
+
+# پروسه ناظر: آپدیت‌ها را از تلگرام دریافت و بر اساس chat_id بین پروسه‌های کارگر تقسیم می‌کند
+# تا پردازش روی چند هسته CPU انجام شود؛ دیتابیس SQLite (حالت WAL) بین همه پروسه‌ها مشترک است
+class Supervisor:
+    def __init__(self, bot, command, workers, port_base, queue_size=1000, recorder=None):
+        self.bot = bot
+        self.recorder = recorder
+        self.workers = []
+        for index in range(workers):
+            env = dict(
+                os.environ,
+                BOT_WORKERS=str(workers),
+                BOT_WORKER_INDEX=str(index),
+                PORT=str(port_base + index),
+                # آپدیت‌ها فقط در پروسه ناظر ضبط می‌شوند
+                RECORD_UPDATES_PATH=""
+            )
+            self.workers.append(WorkerProcess(index, command, env, port_base + index, queue_size))
+        self.registry = Registry()
+        self.registry.callback(
+            "bot_worker_up", "Whether each worker process is running.", "gauge", ("worker",),
+            lambda: {(str(w.index),): int(w.stats()['up']) for w in self.workers}
+        )
+        self.registry.callback(
+            "bot_worker_restarts_total", "Worker process restarts after a crash.", "counter", ("worker",),
+            lambda: {(str(w.index),): w.counters['restarts'] for w in self.workers}
+        )
+        self.registry.callback(
+            "bot_worker_updates_total", "Updates routed to each worker.", "counter", ("worker", "outcome"),
+            lambda: {
+                (str(w.index), outcome): w.counters[outcome]
+                for w in self.workers for outcome in ('forwarded', 'dropped')
+            }
+        )
+        self._session = None
+
+    async def route(self, update, wait=True):
+        if self.recorder:
+            self.recorder.record([update])
+        worker = self.workers[shard_for(update_chat_id(update), len(self.workers))]
+        return await worker.put(update, wait)
+
+    async def poll(self, timeout=20):
+        # وبهوک فعال باشد getUpdates کار نمی‌کند
+        await self.bot.delete_webhook()
+        offset = None
+        while True:
+            try:
+                updates = await asyncio_helper.get_updates(self.bot.token, offset, 100, timeout)
+            except Exception as e:
+                print(f"Polling error: {e}")
+                await asyncio.sleep(3)
+                continue
+            for update in updates:
+                offset = update['update_id'] + 1
+                # صف پر یک کارگر سالم دریافت را کند می‌کند، اما کارگری که در انتظار ری‌استارت است
+                # بقیه را متوقف نمی‌کند؛ آپدیت‌های اضافه آن کنار گذاشته و در dropped شمرده می‌شوند
+                if not await self.route(update):
+                    print(f"Worker queue full, update {update['update_id']} dropped")
+
+    def webhook_handler(self, secret_token):
+        async def handle(request):
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(token, secret_token):
+                return web.Response(status=403)
+            try:
+                update = json.loads(await request.text())
+            except ValueError:
+                return web.Response(status=400)
+            # تلگرام آپدیت رد شده را بعداً دوباره ارسال می‌کند
+            if not await self.route(update, wait=False):
+                return web.Response(status=503)
+            return web.Response()
+        return handle
+
+    async def _fetch(self, worker, path):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=2))
+        try:
+            async with self._session.get(f"http://127.0.0.1:{worker.port}{path}") as resp:
+                if path == '/metrics':
+                    return await resp.text()
+                return await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+
+    async def _gather(self, path, query=None):
+        if query:
+            path = f"{path}?{query}"
+        results = await asyncio.gather(*(self._fetch(worker, path) for worker in self.workers))
+        return [(worker.index, result) for worker, result in zip(self.workers, results) if result is not None]
+
+    async def health(self, request):
+        workers = [worker.stats() for worker in self.workers]
+        healthy = all(worker['up'] for worker in workers)
+        return web.json_response({"healthy": healthy, "workers": workers}, status=200 if healthy else 503)
+
+    async def metrics(self, request):
+        texts = await self._gather('/metrics')
+        return web.Response(
+            body=(self.registry.render() + merge_metrics(texts)).encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    async def worker_stats(self, request):
+        results = await self._gather(request.path, request.query_string)
+        merged = merge_stats([result for _, result in results])
+        if request.path == '/traces':
+            merged['traces'] = slowest_traces(results, request.query.get("limit", "20"))
+        return web.json_response(dict(
+            merged,
+            by_worker={str(index): result for index, result in results}
+        ))
+
+    def add_routes(self, app):
+        app.router.add_get('/health', self.health)
+        app.router.add_get('/metrics', self.metrics)
+        for path in STATS_PATHS:
+            app.router.add_get(path, self.worker_stats)
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    async def stop(self):
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        if self._session is not None:
+            await self._session.close()
+
+async def read_worker_updates(receiver, stream=None):
+    """در پروسه کارگر: آپدیت‌ها را از stdin می‌خواند و به صف پردازش می‌دهد تا stdin بسته شود"""
+    from telebot import types
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=16 * 1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), stream or sys.stdin)
+    while line := await reader.readline():
+        try:
+            update = types.Update.de_json(line.decode())
+        except ValueError as e:
+            print(f"Worker update error: {e}")
+            continue
+        await receiver.put(update)
@@ -0,0 +1,128 @@
+import itertools
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# trace درخواست جاری؛ توابع داخلی بدون نیاز به پارامتر اضافه span ثبت می‌کنند
+_current = ContextVar("trace", default=None)
+_ids = itertools.count(1)
+
+# زمان‌بندی مراحل یک درخواست دانلود
+class Trace:
+    __slots__ = ('trace_id', 'user_id', 'shortcode', 'started_at', 'started', 'duration', 'status', 'spans')
+
+    def __init__(self, user_id, shortcode):
+        self.trace_id = next(_ids)
+        self.user_id = user_id
+        self.shortcode = shortcode
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.spans = []
+
+    def record(self, name, started, error=None):
+        """مرحله‌ای که از started تا الان طول کشیده است"""
+        self.spans.append((name, started - self.started, time.perf_counter() - started, error))
+
+    def to_dict(self):
+        # خروجی HTTP است؛ شناسه کاربر فقط در دستور مدیر نمایش داده می‌شود
+        return {
+            "trace_id": self.trace_id,
+            "shortcode": self.shortcode,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            "status": self.status,
+            "spans": [
+                {
+                    "name": name,
+                    "offset_ms": round(offset * 1000, 2),
+                    "duration_ms": round(duration * 1000, 2),
+                    "error": error
+                }
+                for name, offset, duration, error in self.spans
+            ]
+        }
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.record(self.name, self.started, exc_type.__name__ if exc_type else None)
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+_NOOP = _NoopSpan()
+
+def span(name):
+    """یک مرحله از trace جاری را زمان‌گیری می‌کند؛ بدون trace فعال هزینه‌ای ندارد"""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name)
+
+def set_status(status):
+    """نتیجه درخواست جاری (مثلاً خطای upstream) را روی trace ثبت می‌کند"""
+    trace = _current.get()
+    if trace is not None:
+        trace.status = status
+
+@contextmanager
+def activate(trace):
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+# نگهداری trace های کند در یک ring buffer تا قدیمی‌ها خودبه‌خود کنار بروند
+class Tracer:
+    def __init__(self, slow_threshold=1.0, buffer_size=100):
+        self.slow_threshold = slow_threshold
+        self._slow = deque(maxlen=buffer_size)
+        self.counters = {
+            'started': 0,
+            'finished': 0,
+            'slow': 0
+        }
+
+    def start(self, user_id, shortcode=None):
+        self.counters['started'] += 1
+        return Trace(user_id, shortcode)
+
+    def finish(self, trace, status="ok"):
+        if trace.duration is not None:
+            return
+        trace.duration = time.perf_counter() - trace.started
+        trace.status = trace.status or status
+        self.counters['finished'] += 1
+        if trace.duration >= self.slow_threshold:
+            self.counters['slow'] += 1
+            self._slow.append(trace)
+
+    def slowest(self, limit=20):
+        return sorted(self._slow, key=lambda trace: trace.duration, reverse=True)[:limit]
+
+    def stats(self):
+        return dict(
+            self.counters,
+            buffered=len(self._slow),
+            buffer_size=self._slow.maxlen,
+            slow_threshold_ms=self.slow_threshold * 1000
+        )
@@ -0,0 +1,146 @@
+import asyncio
+
+# خطاهایی که نشان می‌دهند تلگرام نتوانسته فایل را از لینک CDN دریافت کند
+URL_FETCH_ERRORS = (
+    "failed to get HTTP URL content",
+    "wrong file identifier/HTTP URL specified",
+    "wrong type of the web page content",
+    "failed to get HTTP URL"
+)
+
+# خطاهایی که نشان می‌دهند file_id ذخیره‌شده دیگر قابل استفاده نیست
+FILE_ID_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file reference",
+    "file_reference",
+    "type of file mismatch"
+)
+
+# حداکثر حجم فایلی که ربات می‌تواند در تلگرام آپلود کند
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+class MediaTooLarge(Exception):
+    pass
+
+def is_url_fetch_error(e):
+    return e.error_code == 400 and any(text in e.description for text in URL_FETCH_ERRORS)
+
+def is_file_id_error(e):
+    description = e.description.lower()
+    return e.error_code == 400 and any(text in description for text in FILE_ID_ERRORS)
+
+# آپلود رسانه به تلگرام به صورت جریانی: هر تکه از CDN خوانده و بلافاصله در درخواست multipart نوشته می‌شود
+# فایل هیچ‌وقت به طور کامل در حافظه نگه داشته نمی‌شود؛ در صورت وجود کش دیسکی، یک نسخه هم در آن ذخیره می‌شود
+class StreamingUploader:
+    def __init__(self, bot, get_session, concurrency=4, chunk_size=64 * 1024, timeout=600,
+                 max_size=TELEGRAM_UPLOAD_LIMIT, media_cache=None):
+        self.bot = bot
+        self.get_session = get_session
+        self.media_cache = media_cache
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_size = max_size
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._active = 0
+        self.counters = {
+            'uploads': 0,
+            'bytes': 0,
+            'disk_uploads': 0,
+            'too_large': 0,
+            'errors': 0
+        }
+
+    async def _chunks(self, response, writer=None, state=None):
+        size = 0
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            size += len(chunk)
+            if size > self.max_size:
+                # telebot خطای داخل بدنه درخواست را به RequestTimeout تبدیل می‌کند، پس علت جداگانه ثبت می‌شود
+                if state is not None:
+                    state['too_large'] = True
+                raise MediaTooLarge()
+            self.counters['bytes'] += len(chunk)
+            if writer:
+                writer.write(chunk)
+            yield chunk
+        # فایل فقط وقتی در کش قرار می‌گیرد که کامل از CDN خوانده شده باشد
+        if writer:
+            writer.commit()
+
+    async def _upload(self, chat_id, media_type, media, caption):
+        if media_type == "video":
+            return await self.bot.send_video(
+                chat_id,
+                video=("video.mp4", media),
+                caption=caption,
+                supports_streaming=True,
+                timeout=self.timeout
+            )
+        return await self.bot.send_photo(
+            chat_id,
+            photo=("photo.jpg", media),
+            caption=caption,
+            timeout=self.timeout
+        )
+
+    async def _upload_from_disk(self, chat_id, media_type, cache_key, caption):
+        path = self.media_cache.get(cache_key)
+        if path is None:
+            return None
+        try:
+            media = open(path, "rb")
+        except FileNotFoundError:
+            self.media_cache.invalidate(cache_key)
+            return None
+        # فایل هم تکه‌به‌تکه از دیسک خوانده و آپلود می‌شود
+        with media:
+            sent = await self._upload(chat_id, media_type, media, caption)
+        self.counters['disk_uploads'] += 1
+        return sent
+
+    async def _upload_from_cdn(self, chat_id, media_type, url, caption, cache_key):
+        session = await self.get_session()
+        async with session.get(url) as response:
+            response.raise_for_status()
+            if response.content_length and response.content_length > self.max_size:
+                raise MediaTooLarge()
+
+            writer = self.media_cache.writer(cache_key) if self.media_cache and cache_key else None
+            state = {'too_large': False}
+            try:
+                sent = await self._upload(chat_id, media_type, self._chunks(response, writer, state), caption)
+            except Exception:
+                if state['too_large']:
+                    raise MediaTooLarge() from None
+                raise
+            finally:
+                # نوشتن نیمه‌تمام حذف می‌شود (بعد از commit کاری انجام نمی‌دهد)
+                if writer:
+                    writer.discard()
+        self.counters['uploads'] += 1
+        return sent
+
+    async def send(self, chat_id, media_type, url, caption, cache_key=None):
+        """رسانه را از کش دیسکی یا url دریافت و همزمان برای تلگرام آپلود می‌کند و پیام ارسال‌شده را برمی‌گرداند"""
+        # تعداد آپلودهای همزمان محدود است تا پهنای باند و اتصال‌ها بین دانلودها تقسیم شوند
+        async with self._semaphore:
+            self._active += 1
+            try:
+                sent = None
+                if self.media_cache and cache_key:
+                    sent = await self._upload_from_disk(chat_id, media_type, cache_key, caption)
+                if sent is None:
+                    sent = await self._upload_from_cdn(chat_id, media_type, url, caption, cache_key)
+                return sent
+            except MediaTooLarge:
+                self.counters['too_large'] += 1
+                raise
+            except Exception:
+                self.counters['errors'] += 1
+                raise
+            finally:
+                self._active -= 1
+
+    def stats(self):
+        return dict(self.counters, active=self._active)
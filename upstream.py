@@ -0,0 +1,307 @@
+import asyncio
+import json
+import time
+from collections import deque
+import aiohttp
+from tracing import span
+
+class CircuitOpen(Exception):
+    pass
+
+# قطع‌کننده مدار: وقتی در بازه اخیر نسبت خطاها یا درخواست‌های کند از حد بگذرد،
+# درخواست‌ها تا open_seconds بدون تماس با upstream رد می‌شوند؛ سپس یک درخواست آزمایشی
+# (half_open) تصمیم می‌گیرد مدار دوباره بسته شود یا باز بماند
+class CircuitBreaker:
+    def __init__(self, window=30, min_requests=10, error_rate=0.5, slow_seconds=10, slow_rate=0.8, open_seconds=30):
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self._calls = deque()
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = 0
+        self._probing = False
+        self.counters = {
+            'trips': 0,
+            'rejected': 0,
+            'probes': 0
+        }
+
+    def _prune(self, now):
+        while self._calls and self._calls[0][0] < now - self.window:
+            _, failed, slow = self._calls.popleft()
+            self._failures -= failed
+            self._slow -= slow
+
+    def _open(self, now):
+        self.state = "open"
+        self._opened_at = now
+        self.counters['trips'] += 1
+
+    def before(self):
+        """قبل از هر درخواست؛ در صورت باز بودن مدار CircuitOpen می‌دهد"""
+        if self.state == "closed":
+            return
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.open_seconds:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            self.counters['probes'] += 1
+            return
+        self.counters['rejected'] += 1
+        raise CircuitOpen()
+
+    def cancel(self):
+        """درخواستی که لغو شده در آمار حساب نمی‌شود؛ فقط جای درخواست آزمایشی آزاد می‌شود"""
+        self._probing = False
+
+    def record(self, ok, duration):
+        now = time.monotonic()
+        slow = duration >= self.slow_seconds
+        if self.state == "half_open" and self._probing:
+            self._probing = False
+            if ok and not slow:
+                # upstream برگشته است؛ آمار دوره خرابی کنار گذاشته می‌شود
+                self.state = "closed"
+                self._calls.clear()
+                self._failures = 0
+                self._slow = 0
+            else:
+                self._open(now)
+            return
+
+        self._calls.append((now, not ok, slow))
+        self._failures += not ok
+        self._slow += slow
+        self._prune(now)
+        count = len(self._calls)
+        if self.state == "closed" and count >= self.min_requests and (
+            self._failures / count >= self.error_rate or self._slow / count >= self.slow_rate
+        ):
+            self._open(now)
+
+    def stats(self):
+        self._prune(time.monotonic())
+        return dict(
+            self.counters,
+            state=self.state,
+            window_requests=len(self._calls),
+            window_failures=self._failures,
+            window_slow=self._slow
+        )
+
+# کلاینت مشترک برای API دانلود اینستاگرام (fast-creat)
+class UpstreamClient:
+    def __init__(self, api_url, api_key, limit=100, limit_per_host=50, dns_ttl=300,
+                 keepalive_timeout=60, connect_timeout=5, read_timeout=20, total_timeout=30,
+                 breaker=None, hedge=False, hedge_min_delay=0.2, hedge_budget=0.1, hedge_min_samples=20):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        # session با آپلود جریانی (uploader.py) مشترک است، پس محدودیت کل زمان فقط روی درخواست‌های API اعمال می‌شود
+        self.timeout = aiohttp.ClientTimeout(
+            connect=connect_timeout,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout
+        )
+        self.request_timeout = aiohttp.ClientTimeout(
+            total=total_timeout,
+            connect=connect_timeout,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout
+        )
+        self.breaker = breaker
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_budget = hedge_budget
+        self.hedge_min_samples = hedge_min_samples
+        # زمان درخواست‌های موفق اخیر برای محاسبه p95
+        self._latencies = deque(maxlen=200)
+        self._session = None
+        self._connector = None
+        self._waiting = 0
+        self._requests = 0
+        self.hedge_counters = {
+            'fetches': 0,
+            'hedged': 0,
+            'primary_wins': 0,
+            'hedge_wins': 0
+        }
+
+    def _trace_config(self):
+        # شمارش درخواست‌هایی که منتظر آزاد شدن یک اتصال در pool هستند
+        trace = aiohttp.TraceConfig()
+
+        async def on_queued_start(session, ctx, params):
+            self._waiting += 1
+
+        async def on_queued_end(session, ctx, params):
+            self._waiting -= 1
+
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        return trace
+
+    async def get_session(self):
+        # session یک بار ساخته می‌شود و اتصال‌ها بین همه درخواست‌ها به اشتراک گذاشته می‌شوند
+        if self._session is None or self._session.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                use_dns_cache=True,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=self._connector,
+                timeout=self.timeout,
+                trace_configs=[self._trace_config()]
+            )
+        return self._session
+
+    async def _request(self, url):
+        params = {"apikey": self.api_key, "type": "post", "url": url}
+        session = await self.get_session()
+        self._requests += 1
+        started = time.monotonic()
+        with span("upstream_request"):
+            async with session.get(self.api_url, params=params, timeout=self.request_timeout) as resp:
+                body = await resp.read()
+                status = resp.status
+        with span("json_decode"):
+            data = json.loads(body)
+        if status < 500:
+            self._latencies.append(time.monotonic() - started)
+        return data, status
+
+    def hedge_delay(self):
+        """زمان انتظار قبل از درخواست دوم (p95 اخیر) یا None اگر هنوز نمونه کافی نیست"""
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return max(latencies[int(len(latencies) * 0.95) - 1], self.hedge_min_delay)
+
+    async def _hedged_request(self, url):
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(self._request(url))
+        tasks = {primary}
+        try:
+            # سهم درخواست‌های دوم محدود است تا upstream کند زیر بار دوبرابر نرود
+            if delay is None or self.hedge_counters['hedged'] >= self.hedge_budget * self.hedge_counters['fetches']:
+                return await primary
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result()
+
+            self.hedge_counters['hedged'] += 1
+            hedge = asyncio.ensure_future(self._request(url))
+            tasks.add(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # پاسخ 5xx برنده نیست؛ منتظر درخواست دیگر می‌مانیم
+                    if task.exception() is None and task.result()[1] < 500:
+                        self.hedge_counters['hedge_wins' if task is hedge else 'primary_wins'] += 1
+                        return task.result()
+            # هر دو درخواست خطا داده‌اند
+            return primary.result()
+        finally:
+            for task in tasks:
+                if task.done() and not task.cancelled():
+                    # خطای درخواست بازنده هم خوانده می‌شود تا در لاگ asyncio ثبت نشود
+                    task.exception()
+                else:
+                    task.cancel()
+
+    async def fetch_post(self, url):
+        if self.breaker:
+            self.breaker.before()
+        self.hedge_counters['fetches'] += 1
+        started = time.monotonic()
+        try:
+            data, status = await (self._hedged_request(url) if self.hedge else self._request(url))
+        except asyncio.CancelledError:
+            # لغو شدن درخواست (مثلاً هنگام خاموش شدن) خطای upstream نیست
+            if self.breaker:
+                self.breaker.cancel()
+            raise
+        except Exception:
+            if self.breaker:
+                self.breaker.record(False, time.monotonic() - started)
+            raise
+        if self.breaker:
+            self.breaker.record(status < 500, time.monotonic() - started)
+        return data
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._connector = None
+
+    def stats(self):
+        connector = self._connector
+        in_use = 0
+        idle = 0
+        if connector is not None and not connector.closed:
+            # aiohttp این اعداد را به صورت عمومی ارائه نمی‌دهد
+            in_use = len(getattr(connector, "_acquired", ()))
+            idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return {
+            "open": in_use + idle,
+            "in_use": in_use,
+            "idle": idle,
+            "waiting": self._waiting,
+            "requests": self._requests,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host
+        }
+
+    def hedge_stats(self):
+        delay = self.hedge_delay()
+        hedged = self.hedge_counters['hedged']
+        return dict(
+            self.hedge_counters,
+            enabled=self.hedge,
+            delay_ms=round(delay * 1000, 1) if delay is not None else None,
+            hedge_win_rate=round(self.hedge_counters['hedge_wins'] / hedged, 4) if hedged else 0.0
+        )
+
+# ادغام درخواست‌های همزمان برای یک کلید: فقط اولین درخواست به upstream می‌رود
+# و بقیه منتظر همان نتیجه می‌مانند
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        # لغو شدن یک منتظر نباید درخواست مشترک را لغو کند
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced
+        }
@@ -0,0 +1,116 @@
+import asyncio
+import hmac
+import json
+from aiohttp import web
+from telebot import types
+
+def update_chat_id(update):
+    # message، callback_query (پیام ربات در همان چت)، chat_member و ... ؛ در غیر این صورت فرستنده
+    for key, value in vars(update).items():
+        if key == 'update_id' or value is None:
+            continue
+        chat = getattr(value, 'chat', None) or getattr(getattr(value, 'message', None), 'chat', None)
+        if chat is not None:
+            return chat.id
+        user = getattr(value, 'from_user', None) or getattr(value, 'user', None)
+        if user is not None:
+            return user.id
+    return 0
+
+# دریافت آپدیت‌ها از طریق وبهوک تلگرام
+# درخواست بلافاصله با 200 پاسخ داده می‌شود و پردازش در صف انجام می‌شود
+# آپدیت‌های چت‌های مختلف همزمان و آپدیت‌های یک چت به ترتیب دریافت پردازش می‌شوند
+class WebhookReceiver:
+    def __init__(self, bot, secret_token, queue_size=1000, workers=64, recorder=None):
+        self.bot = bot
+        self.secret_token = secret_token
+        self.recorder = recorder
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.workers = workers
+        self._tasks = []
+        # قفل هر چت (قفل، تعداد آپدیت‌های منتظر یا در حال پردازش)
+        self._chat_locks = {}
+        self.counters = {
+            'received': 0,
+            'rejected': 0,
+            'dropped': 0,
+            'processed': 0,
+            'errors': 0
+        }
+
+    async def handle(self, request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, self.secret_token):
+            self.counters['rejected'] += 1
+            return web.Response(status=403)
+
+        try:
+            json_update = json.loads(await request.text())
+            update = types.Update.de_json(json_update)
+        except ValueError:
+            self.counters['rejected'] += 1
+            return web.Response(status=400)
+
+        if self.recorder:
+            self.recorder.record([json_update])
+
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # تلگرام آپدیت را بعداً دوباره ارسال می‌کند
+            self.counters['dropped'] += 1
+            return web.Response(status=503)
+
+        self.counters['received'] += 1
+        return web.Response()
+
+    async def put(self, update):
+        # آپدیتی که از پروسه ناظر رسیده است؛ با پر بودن صف منتظر می‌ماند
+        await self.queue.put(update)
+        self.counters['received'] += 1
+
+    async def _process(self, update):
+        # بین برداشتن از صف و درخواست قفل await وجود ندارد و asyncio.Lock به ترتیب درخواست آزاد می‌شود،
+        # پس ترتیب آپدیت‌های یک چت همان ترتیب صف است
+        chat_id = update_chat_id(update)
+        entry = self._chat_locks.get(chat_id)
+        if entry is None:
+            entry = self._chat_locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self.bot.process_new_updates([update])
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat_id]
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self._process(update)
+                self.counters['processed'] += 1
+            except Exception as e:
+                self.counters['errors'] += 1
+                print(f"Webhook update error: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        return dict(
+            self.counters,
+            queue_depth=self.queue.qsize(),
+            queue_size=self.queue.maxsize,
+            active_chats=len(self._chat_locks),
+            workers=len(self._tasks)
+        )